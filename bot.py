@@ -10,7 +10,8 @@ from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQu
 from telegram.error import NetworkError, TelegramError
 
 import config
-from modulos import comandos, interprete, callback_handlers
+import asyncio
+from modulos import comandos, interprete, callback_handlers, mantenimiento, historial
 
 # Configuración de logging
 logging.basicConfig(
@@ -43,6 +44,15 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Usa /help para ver comandos disponibles."
     )
 
+async def post_init(application: Application):
+    """Arranque: tareas de fondo y descargas que quedaron a medias"""
+    mantenimiento.iniciar()
+    await interprete.reanudar_descargas(application)
+
+async def post_shutdown(application: Application):
+    await mantenimiento.detener()
+    await asyncio.to_thread(historial.vaciar)  # Registros aún en el buffer write-behind
+
 def main():
     try:
         # Verificar configuración
@@ -51,7 +61,13 @@ def main():
             sys.exit(1)
         
         # Crear aplicación
-        app = Application.builder().token(config.TOKEN).build()
+        app = (
+            Application.builder()
+            .token(config.TOKEN)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
         
         # === REGISTRAR TODOS LOS COMANDOS ===
         app.add_handler(CommandHandler("start", comandos.start))
@@ -61,6 +77,7 @@ def main():
         app.add_handler(CommandHandler("game", comandos.game_command))
         app.add_handler(CommandHandler("qr", comandos.qr_command))
         app.add_handler(CommandHandler("stats", comandos.stats_command))
+        app.add_handler(CommandHandler("archivos", comandos.archivos_command))
         
         # === CALLBACKS (BOTONES) ===
         app.add_handler(CallbackQueryHandler(callback_handlers.handle_callback))
@@ -83,7 +100,8 @@ def main():
         print("=" * 50)
         
         # Ejecutar
-        app.run_polling(drop_pending_updates=True)
+        # Sin descartar updates: las URLs enviadas mientras el bot estaba caído también se procesan
+        app.run_polling(drop_pending_updates=False)
         
     except Exception as e:
         logger.error(f"❌ Error crítico: {e}")
@@ -75,11 +75,14 @@ _setup_directories()
 STORAGE_LIMIT_GB = int(os.getenv("STORAGE_LIMIT_GB", "20"))
 if STORAGE_LIMIT_GB < 1 or STORAGE_LIMIT_GB > 1000:
     raise ValueError("❌ STORAGE_LIMIT_GB debe estar entre 1 y 1000")
+# Qué borrar primero al llegar al límite: lru, lfu, gdsf (tamaño+frecuencia) o mtime
+EVICTION_POLICY = os.getenv("EVICTION_POLICY", "lru").lower()
 
 # Límites de descarga
 MAX_PARALLEL_DOWNLOADS = int(os.getenv("MAX_PARALLEL_DOWNLOADS", "3"))
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "2000"))  # 2GB por archivo
 CHUNK_SIZE_MB = int(os.getenv("CHUNK_SIZE_MB", "10"))  # Para chunked downloads
+CHUNK_CONNECTIONS = int(os.getenv("CHUNK_CONNECTIONS", "4"))  # Conexiones simultáneas por archivo
 
 # Límites de recursos del sistema
 MAX_CPU_PERCENT = int(os.getenv("MAX_CPU_PERCENT", "90"))
@@ -170,8 +173,11 @@ def validate_config():
     """Valida toda la configuración al importar el módulo"""
     validations = [
         (STORAGE_LIMIT_GB > 0, "STORAGE_LIMIT_GB debe ser positivo"),
+        (EVICTION_POLICY in ("lru", "lfu", "gdsf", "mtime"), "EVICTION_POLICY debe ser lru, lfu, gdsf o mtime"),
         (MAX_PARALLEL_DOWNLOADS > 0, "MAX_PARALLEL_DOWNLOADS debe ser positivo"),
         (MAX_FILE_SIZE_MB > 0, "MAX_FILE_SIZE_MB debe ser positivo"),
+        (CHUNK_SIZE_MB > 0, "CHUNK_SIZE_MB debe ser positivo"),
+        (0 < CHUNK_CONNECTIONS <= 32, "CHUNK_CONNECTIONS debe estar entre 1-32"),
         (0 < MAX_CPU_PERCENT <= 100, "MAX_CPU_PERCENT debe estar entre 1-100"),
         (0 < MAX_RAM_PERCENT <= 100, "MAX_RAM_PERCENT debe estar entre 1-100"),
         (MIN_FREE_DISK_GB > 0, "MIN_FREE_DISK_GB debe ser positivo"),
@@ -6,6 +6,7 @@ Menús interactivos de SouaweakBot con soporte para imágenes.
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, Application, CommandHandler, MessageHandler, filters
 from .Botones import menu_principal, botones_confirmacion
+from modulos import file_ids
 
 # --- Función genérica para mostrar un menú con imagen ---
 async def mostrar_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, 
@@ -21,9 +22,9 @@ async def mostrar_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
         imagen_path: Ruta de la imagen opcional.
     """
     if imagen_path:
-        # Si hay imagen, se envía con caption y botones
-        await update.message.reply_photo(
-            photo=open(imagen_path, "rb"),
+        # Si hay imagen, se envía con caption y botones (por file_id si ya se subió antes)
+        await file_ids.enviar(
+            update.message, "foto", imagen_path,
             caption=texto,
             reply_markup=botones
         )
@@ -0,0 +1,68 @@
+"""
+analisis_cache.py
+Caché persistente de resultados del análisis de imágenes (QR, metadata, seguridad...).
+Los resultados se guardan por contenido (SHA-256 de la imagen) y por analizador.
+Telegram conserva el file_unique_id de una foto reenviada, así que un reenvío se reconoce
+antes de descargarla; si llega como otro archivo con el mismo contenido, lo reconoce el hash.
+En disco con diskcache: caducan a los TTL segundos y se evictan (LRU) pasado LIMITE_BYTES.
+"""
+
+import logging
+import diskcache
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = "downloads/.analisis_cache"  # Oculto: storage_manager no lo indexa
+TTL = 30 * 24 * 3600                      # Segundos que vive un resultado
+LIMITE_BYTES = 256 * 1024 * 1024
+
+ESTADISTICAS = {"aciertos": 0, "fallos": 0}
+
+_cache = None
+
+def _abrir() -> diskcache.Cache:
+    global _cache
+    if _cache is None:
+        _cache = diskcache.Cache(CACHE_PATH, size_limit=LIMITE_BYTES,
+                                 eviction_policy="least-recently-used")
+    return _cache
+
+def digest_de(file_unique_id: str):
+    """Hash de contenido ya visto para ese file_unique_id de Telegram, o None"""
+    return _abrir().get(("unico", file_unique_id)) if file_unique_id else None
+
+def recordar_digest(file_unique_id: str, digest: str):
+    if file_unique_id:
+        _abrir().set(("unico", file_unique_id), digest, expire=TTL)
+
+def obtener(digest: str, analizadores) -> dict:
+    """Resultados guardados de esos analizadores para el contenido: {analizador: resultado}"""
+    cache = _abrir()
+    encontrados = {}
+    for nombre in analizadores:
+        resultado = cache.get(("resultado", digest, nombre))
+        if resultado is not None:
+            encontrados[nombre] = resultado
+    ESTADISTICAS["aciertos"] += len(encontrados)
+    ESTADISTICAS["fallos"] += len(analizadores) - len(encontrados)
+    return encontrados
+
+def guardar(digest: str, nombre: str, resultado):
+    try:
+        _abrir().set(("resultado", digest, nombre), resultado, expire=TTL)
+    except Exception as e:
+        logger.warning(f"[analisis_cache] No se pudo guardar {nombre} de {digest[:12]}: {e}")
+
+def datos_de(digest: str, nombre: str):
+    """Datos auxiliares que guardó un analizador para repetir sus efectos en un acierto, o None"""
+    return _abrir().get(("datos", digest, nombre))
+
+def guardar_datos(digest: str, nombre: str, datos):
+    try:
+        _abrir().set(("datos", digest, nombre), datos, expire=TTL)
+    except Exception as e:
+        logger.warning(f"[analisis_cache] No se pudieron guardar los datos de {nombre} de {digest[:12]}: {e}")
+
+def estadisticas() -> dict:
+    cache = _abrir()
+    return {**ESTADISTICAS, "entradas": len(cache), "bytes": cache.volume()}
@@ -6,8 +6,10 @@ Estilo L: cada callback tiene su lógica específica.
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from modulos import historial, kotatsu
+import asyncio
+from modulos import historial, kotatsu, derivados, download_queue, file_ids, storage_manager, comandos
 import random
+import config
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -48,6 +50,18 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "history_stats":
         await callback_history_stats(update, context)
     
+    # === DERIVADOS BAJO DEMANDA (audio, miniatura...) ===
+    elif data.startswith("deriv:"):
+        await callback_derivado(update, context)
+    
+    # === EXPLORADOR DE ARCHIVOS (admin) ===
+    elif data.startswith("archivos_pag:"):
+        await callback_archivos_pagina(update, context)
+    
+    # === HISTORIAL PAGINADO ===
+    elif data.startswith("hist_page:"):
+        await callback_historial_pagina(update, context)
+    
     # === JUEGOS CALLBACKS ===
     elif data == "game_guess":
         await callback_game_guess(update, context)
@@ -160,7 +174,7 @@ async def callback_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def callback_historial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mostrar historial del usuario"""
     usuario_id = update.callback_query.from_user.id
-    registros = historial.ultimo(usuario_id, 5)
+    registros = await asyncio.to_thread(historial.ultimo, usuario_id, 5)
     
     if not registros:
         texto = (
@@ -172,10 +186,7 @@ async def callback_historial(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         texto = "📜 **TU HISTORIAL** (últimos 5):\n\n"
         for i, registro in enumerate(registros, 1):
-            tipo_emoji = {
-                "videos": "🎬", "audio": "🎵", "fotos": "📷",
-                "mangas": "📚", "qr": "🔍"
-            }.get(registro["tipo"], "📄")
+            tipo_emoji = historial.TIPO_EMOJI.get(registro["tipo"], "📄")
             
             texto += f"{i}. {tipo_emoji} {registro['nombre'][:30]}...\n"
             texto += f"   📅 {registro['fecha']}\n\n"
@@ -185,6 +196,7 @@ async def callback_historial(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 InlineKeyboardButton("🗑️ Limpiar", callback_data="clear_history"),
                 InlineKeyboardButton("📊 Estadísticas", callback_data="history_stats")
             ],
+            [InlineKeyboardButton("📜 Ver todo", callback_data="hist_page:0")],
             [InlineKeyboardButton("🔙 Volver", callback_data="back_main")]
         ]
     
@@ -261,6 +273,42 @@ async def callback_qr(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
+async def callback_derivado(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Genera (o reutiliza) un derivado del video y lo envía"""
+    query = update.callback_query
+    _, nombre, ref = query.data.split(":", 2)
+    ruta_padre = derivados.ruta_de_referencia(ref)
+    if nombre not in derivados.DERIVADOS or not ruta_padre:
+        await query.message.reply_text("❌ El archivo original ya no está disponible. Envía la URL de nuevo.")
+        return
+
+    # ffmpeg corre en el pool de descargas; peticiones repetidas comparten la misma generación
+    try:
+        with storage_manager.fijados(ruta_padre):
+            ruta = await download_queue.encolar(query.from_user.id, derivados.obtener, ruta_padre, nombre)
+            with storage_manager.fijados(ruta):
+                await file_ids.enviar(query.message, derivados.tipo_envio(nombre), ruta)
+    except Exception as e:
+        await query.message.reply_text(f"❌ No se pudo generar {nombre}: {e}")
+
+async def callback_archivos_pagina(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cambia de página en el explorador de /archivos"""
+    query = update.callback_query
+    if query.from_user.id not in config.ADMIN_USER_IDS:
+        return
+    texto, botones = await asyncio.to_thread(
+        comandos.pagina_archivos, context, int(query.data.split(":", 1)[1])
+    )
+    await query.edit_message_text(texto, reply_markup=botones)
+
+async def callback_historial_pagina(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cambia de página en el historial del usuario"""
+    query = update.callback_query
+    texto, botones = await asyncio.to_thread(
+        comandos.pagina_historial, query.from_user.id, int(query.data.split(":", 1)[1])
+    )
+    await query.edit_message_text(texto, reply_markup=botones)
+
 # === CALLBACKS DE JUEGOS ===
 
 async def callback_game_dice(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -353,7 +401,24 @@ async def callback_clear_history(update, context):
     await update.callback_query.edit_message_text("🗑️ Función de limpieza en desarrollo...")
 
 async def callback_history_stats(update, context):
-    await update.callback_query.edit_message_text("📊 Estadísticas en desarrollo...")
+    """Resumen del historial del usuario desde los contadores agregados"""
+    usuario_id = update.callback_query.from_user.id
+    resumen = await asyncio.to_thread(historial.estadisticas, usuario_id)
+
+    if not resumen["total"]:
+        texto = "📊 **TUS ESTADÍSTICAS**\n\n🤷‍♂️ Aún no tienes descargas registradas."
+    else:
+        texto = f"📊 **TUS ESTADÍSTICAS**\n\n📈 Total: {resumen['total']} descargas\n\n"
+        for tipo, n in sorted(resumen["tipos"].items(), key=lambda t: t[1], reverse=True):
+            texto += f"{historial.TIPO_EMOJI.get(tipo, '📄')} {tipo.capitalize()}: {n}\n"
+        texto += f"\n📅 Última: {resumen['ultima']}"
+
+    keyboard = [[InlineKeyboardButton("🔙 Volver", callback_data="historial")]]
+    await update.callback_query.edit_message_text(
+        texto,
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
 async def callback_game_guess(update, context):
     await update.callback_query.edit_message_text("🎯 Juego de adivinanza en desarrollo...")
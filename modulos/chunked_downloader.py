@@ -1,20 +1,28 @@
 """
 chunked_downloader.py
 Descarga de archivos grandes (videos/audio) en partes para optimizar uso de recursos.
+Usa varias conexiones con peticiones Range cuando el servidor lo permite.
 Integración directa con downloader.py.
 """
 
 import os
 import re
+import copy
+import yt_dlp
 import aiohttp
 import asyncio
 import psutil  # Para monitoreo de recursos
 import logging
-from modulos import historial, storage_manager
+import config
+from modulos import historial, storage_manager, persistencia
 
 logger = logging.getLogger(__name__)
 
-CHUNK_SIZE = 10 * 1024 * 1024  # 10 MB por chunk, ajustable
+CHUNK_SIZE = config.CHUNK_SIZE_MB * 1024 * 1024  # Tamaño de cada segmento/chunk
+SEGMENTOS_PARALELOS = config.CHUNK_CONNECTIONS  # Conexiones simultáneas por archivo
+REINTENTOS_SEGMENTO = 3
+BLOQUE_LECTURA = 1024 * 1024  # 1 MB por lectura de socket
+TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
 
 def recursos_disponibles(min_cpu=20, min_ram=200):
     """
@@ -26,6 +34,215 @@ def recursos_disponibles(min_cpu=20, min_ram=200):
     ram_libre = psutil.virtual_memory().available / (1024 * 1024)
     return cpu_libre >= min_cpu and ram_libre >= min_ram
 
+async def _esperar_recursos(nombre_archivo: str):
+    """Pausa mientras el sistema esté saturado (la medición bloquea, va en un hilo)"""
+    while not await asyncio.to_thread(recursos_disponibles):
+        logger.warning(f"[chunked_downloader] Recursos bajos, pausando descarga de {nombre_archivo}")
+        await asyncio.sleep(5)
+
+async def sondear(session, url: str, headers: dict = None) -> dict:
+    """
+    HEAD + petición Range de 1 byte para conocer el tamaño y si el servidor acepta rangos.
+    """
+    headers = headers or {}
+    sonda = {"tamaño": 0, "rangos": False, "etag": None, "last_modified": None}
+
+    try:
+        async with session.head(url, headers=headers, allow_redirects=True) as resp:
+            if resp.status == 200:
+                sonda["tamaño"] = int(resp.headers.get("Content-Length", 0))
+                sonda["rangos"] = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+                sonda["etag"] = resp.headers.get("ETag")
+                sonda["last_modified"] = resp.headers.get("Last-Modified")
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        pass  # Hay servidores que no implementan HEAD
+
+    if not sonda["rangos"] or not sonda["tamaño"]:
+        # Algunos servidores no anuncian Accept-Ranges: se comprueba pidiendo el primer byte
+        try:
+            async with session.get(url, headers={**headers, "Range": "bytes=0-0"}) as resp:
+                rango = resp.headers.get("Content-Range", "")  # bytes 0-0/123456
+                if resp.status == 206 and rango.rsplit("/", 1)[-1].isdigit():
+                    sonda["rangos"] = True
+                    sonda["tamaño"] = int(rango.rsplit("/", 1)[-1])
+                    sonda["etag"] = sonda["etag"] or resp.headers.get("ETag")
+                    sonda["last_modified"] = sonda["last_modified"] or resp.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+    return sonda
+
+def _segmentos(tamaño: int, completos=()):
+    """
+    Divide los bytes aún no descargados de [0, tamaño) en rangos inclusivos de CHUNK_SIZE.
+    completos: rangos [inicio, fin] ya verificados (de un manifiesto anterior).
+    """
+    segmentos = []
+    cursor = 0
+    for inicio_ok, fin_ok in sorted(completos) + [(tamaño, tamaño)]:
+        for inicio in range(cursor, inicio_ok, CHUNK_SIZE):
+            segmentos.append((inicio, min(inicio + CHUNK_SIZE, inicio_ok) - 1))
+        cursor = max(cursor, fin_ok + 1)
+    return segmentos
+
+# ----------------------------
+# Manifiesto de reanudación (sidecar junto al .part)
+# ----------------------------
+def _ruta_manifiesto(ruta_parcial: str) -> str:
+    return ruta_parcial + ".json"
+
+def _leer_manifiesto(ruta_parcial: str, url: str, sonda: dict):
+    """
+    Devuelve los rangos completos de una descarga anterior si sigue siendo válida:
+    mismo tamaño y mismos validadores (ETag/Last-Modified) que el servidor actual.
+    """
+    if not os.path.exists(ruta_parcial):
+        return []
+    manifiesto = persistencia.cargar_json(_ruta_manifiesto(ruta_parcial))
+    if not manifiesto:
+        return []
+
+    if manifiesto.get("tamaño") != sonda["tamaño"]:
+        return []
+    for validador in ("etag", "last_modified"):
+        if manifiesto.get(validador) and sonda[validador] and manifiesto[validador] != sonda[validador]:
+            logger.info(f"[chunked_downloader] {validador} cambió, se descarta el parcial de {url}")
+            return []
+    return [tuple(r) for r in manifiesto.get("completos", [])]
+
+def _guardar_manifiesto(ruta_parcial: str, url: str, sonda: dict, completos):
+    """Escritura atómica del manifiesto para que un corte no lo deje a medias"""
+    manifiesto = {
+        "url": url,
+        "tamaño": sonda["tamaño"],
+        "etag": sonda["etag"],
+        "last_modified": sonda["last_modified"],
+        "completos": sorted(completos),
+    }
+    persistencia.guardar_json(_ruta_manifiesto(ruta_parcial), manifiesto)
+
+async def _descargar_segmento(session, url, headers, f, inicio, fin, nombre_archivo):
+    """
+    Descarga bytes [inicio, fin] y los escribe en su offset.
+    Cada reintento continúa desde el último byte escrito del segmento.
+    """
+    pos = inicio
+    for intento in range(1, REINTENTOS_SEGMENTO + 1):
+        try:
+            async with session.get(url, headers={**headers, "Range": f"bytes={pos}-{fin}"}) as resp:
+                if resp.status != 206:
+                    raise IOError(f"HTTP {resp.status} en petición Range")
+                async for bloque in resp.content.iter_chunked(BLOQUE_LECTURA):
+                    bloque = bloque[:fin + 1 - pos]
+                    # Sin await entre seek y write: seguro frente a los demás segmentos
+                    f.seek(pos)
+                    f.write(bloque)
+                    pos += len(bloque)
+                    if pos > fin:
+                        break
+            if pos > fin:
+                return fin + 1 - inicio
+            raise IOError("conexión cerrada antes de tiempo")
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+            logger.warning(
+                f"[chunked_downloader] {nombre_archivo}: segmento {inicio}-{fin} "
+                f"falló (intento {intento}/{REINTENTOS_SEGMENTO}): {e}"
+            )
+            if intento < REINTENTOS_SEGMENTO:
+                await asyncio.sleep(2 ** intento)
+    raise IOError(f"Segmento {inicio}-{fin} falló tras {REINTENTOS_SEGMENTO} intentos")
+
+async def _descargar_segmentado(session, url, headers, ruta_parcial, sonda):
+    """
+    N conexiones concurrentes escribiendo en un archivo preasignado.
+    Cada segmento terminado se anota en el manifiesto; al reiniciar solo se piden los que faltan.
+    """
+    nombre_archivo = os.path.basename(ruta_parcial)
+    tamaño = sonda["tamaño"]
+    completos = _leer_manifiesto(ruta_parcial, url, sonda)
+    segmentos = _segmentos(tamaño, completos)
+    limite = asyncio.Semaphore(SEGMENTOS_PARALELOS)
+    descargado = tamaño - sum(fin + 1 - inicio for inicio, fin in segmentos)
+
+    if completos:
+        logger.info(f"[chunked_downloader] {nombre_archivo}: reanudando, {descargado} bytes ya verificados")
+    else:
+        _guardar_manifiesto(ruta_parcial, url, sonda, completos)
+
+    with open(ruta_parcial, "r+b" if completos else "wb") as f:
+        f.truncate(tamaño)  # Preasignar el archivo completo
+
+        async def tarea(inicio, fin):
+            nonlocal descargado
+            async with limite:
+                await _esperar_recursos(nombre_archivo)
+                bytes_segmento = await _descargar_segmento(session, url, headers, f, inicio, fin, nombre_archivo)
+                descargado += bytes_segmento
+                f.flush()
+                os.fsync(f.fileno())  # Los bytes deben estar en disco antes de marcarlos como completos
+                completos.append((inicio, fin))
+                _guardar_manifiesto(ruta_parcial, url, sonda, completos)
+                logger.info(f"[chunked_downloader] {nombre_archivo}: {descargado / tamaño * 100:.2f}% descargado")
+
+        tareas = [asyncio.ensure_future(tarea(inicio, fin)) for inicio, fin in segmentos]
+        try:
+            await asyncio.gather(*tareas)
+        except BaseException:
+            # Un segmento falló (o nos cancelaron): los demás no pueden seguir escribiendo
+            # en `f` ni usando la sesión después de que el llamador las cierre
+            for t in tareas:
+                t.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+            raise
+    return descargado
+
+async def _descargar_stream(session, url, headers, ruta_local):
+    """Descarga secuencial por una sola conexión (servidores sin soporte de rangos)"""
+    nombre_archivo = os.path.basename(ruta_local)
+    async with session.get(url, headers=headers) as resp:
+        if resp.status != 200:
+            raise IOError(f"HTTP {resp.status} al acceder a {url}")
+
+        tamaño_total = int(resp.headers.get("Content-Length", 0))
+        descargado = 0
+
+        with open(ruta_local, "wb") as f:
+            while True:
+                await _esperar_recursos(nombre_archivo)
+                chunk = await resp.content.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                descargado += len(chunk)
+                porcentaje = (descargado / tamaño_total * 100) if tamaño_total else 0
+                logger.info(f"[chunked_downloader] {nombre_archivo}: {porcentaje:.2f}% descargado")
+    return descargado
+
+async def descargar_archivo(url: str, ruta_local: str, headers: dict = None) -> int:
+    """
+    Descarga url en ruta_local. Usa varias conexiones con Range si el servidor lo permite
+    y recurre a un único stream si no. Devuelve los bytes descargados.
+    Mientras tanto escribe en ruta_local + ".part"; con rangos, una descarga interrumpida
+    (caída del proceso o de la red) se reanuda desde los segmentos ya verificados.
+    """
+    headers = headers or {}
+    ruta_parcial = ruta_local + ".part"
+    async with aiohttp.ClientSession(timeout=TIMEOUT) as session:
+        sonda = await sondear(session, url, headers)
+        if sonda["rangos"] and sonda["tamaño"] > CHUNK_SIZE:
+            logger.info(
+                f"[chunked_downloader] {os.path.basename(ruta_local)}: "
+                f"{(sonda['tamaño'] + CHUNK_SIZE - 1) // CHUNK_SIZE} segmentos, {SEGMENTOS_PARALELOS} conexiones"
+            )
+            descargado = await _descargar_segmentado(session, url, headers, ruta_parcial, sonda)
+        else:
+            descargado = await _descargar_stream(session, url, headers, ruta_parcial)
+
+    os.replace(ruta_parcial, ruta_local)
+    if os.path.exists(_ruta_manifiesto(ruta_parcial)):
+        os.remove(_ruta_manifiesto(ruta_parcial))
+    return descargado
+
 
 async def descargar_chunked(url: str, usuario_id: int, tipo_archivo="video"):
     """
@@ -39,35 +256,50 @@ async def descargar_chunked(url: str, usuario_id: int, tipo_archivo="video"):
     os.makedirs(carpeta, exist_ok=True)
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    return f"❌ Error al acceder a URL: {url}"
-
-                tamaño_total = int(resp.headers.get("Content-Length", 0))
-                descargado = 0
-
-                with open(ruta_local, "wb") as f:
-                    while True:
-                        if not recursos_disponibles():
-                            logger.warning(f"[chunked_downloader] Recursos bajos, pausando descarga de {nombre_archivo}")
-                            await asyncio.sleep(5)
-                            continue
-
-                        chunk = await resp.content.read(CHUNK_SIZE)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                        descargado += len(chunk)
-                        porcentaje = (descargado / tamaño_total * 100) if tamaño_total else 0
-                        logger.info(f"[chunked_downloader] {nombre_archivo}: {porcentaje:.2f}% descargado")
+        await descargar_archivo(url, ruta_local)
 
         # Guardar en storage_manager y registrar historial
         storage_manager.guardar_archivo(ruta_local, tipo_archivo)
-        historial.registrar(usuario_id, nombre_archivo, tipo_archivo, url, duracion=0)
+        await asyncio.to_thread(historial.registrar, usuario_id, nombre_archivo, tipo_archivo, url, duracion=0)
 
         return f"✅ Descarga completa: {nombre_archivo}"
 
     except Exception as e:
         logger.error(f"[chunked_downloader] Error descargando {url}: {str(e)}")
-        return f"❌ Error descargando {nombre_archivo}: {str(e)}"
\ No newline at end of file
+        return f"❌ Error descargando {nombre_archivo}: {str(e)}"
+
+
+def _url_directa(info):
+    """URL del medio si el formato elegido es un único archivo HTTP (sin merge ni fragmentos)"""
+    if not info or info.get('requested_formats'):
+        return None
+    if info.get('protocol') not in ('http', 'https'):
+        return None
+    return info.get('url')
+
+def descargar(url: str, ydl_opts: dict, info=None):
+    """
+    Punto de entrada síncrono usado por downloader/parallel_downloader para archivos grandes.
+    Si el formato es un archivo HTTP directo usa el motor de rangos; si no, yt-dlp por bloques.
+    Reutiliza el info dict si ya existe.
+    """
+    opts = dict(ydl_opts, http_chunk_size=CHUNK_SIZE)
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        url_medio = _url_directa(info)
+        if url_medio:
+            ruta_local = ydl.prepare_filename(info)
+            os.makedirs(os.path.dirname(ruta_local) or ".", exist_ok=True)
+            # Corre en un hilo del pool de descargas: tiene su propio event loop
+            asyncio.run(descargar_archivo(url_medio, ruta_local, info.get('http_headers')))
+            return ruta_local
+
+        if info:
+            resultado = ydl.process_ie_result(copy.deepcopy(info), download=True)
+        else:
+            resultado = ydl.extract_info(url, download=True)
+        if not resultado:
+            raise ValueError("No se pudo extraer información del video.")
+        descargas = resultado.get('requested_downloads') or []
+        if descargas and descargas[0].get('filepath'):
+            return descargas[0]['filepath']
+        return ydl.prepare_filename(resultado)
@@ -6,7 +6,11 @@ Incluye todos los comandos mencionados en la estructura.
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from modulos import historial, kotatsu
+import os
+import time
+import asyncio
+import config
+from modulos import historial, kotatsu, download_queue, postproceso, storage_manager, compressor, analisis_cache
 
 # --- Comandos básicos ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -61,6 +65,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "**📚 CONTENIDO:**\n"
         "/kotatsu - Buscar y descargar mangas\n"
         "/historial - Ver tu historial de descargas\n"
+        "/historial buscar <texto> - Buscar en tu historial\n"
         "/game - Iniciar mini-juegos\n"
         "/qr - Información sobre códigos QR\n\n"
         "**🤖 FUNCIONALIDADES AUTOMÁTICAS:**\n"
@@ -120,59 +125,58 @@ async def kotatsu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def historial_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Ver historial de descargas del usuario"""
+    """Ver historial de descargas del usuario, paginado. Uso: /historial [buscar <texto>]"""
     usuario_id = update.message.from_user.id
-    
-    # Obtener historial del usuario
-    registros = historial.ultimo(usuario_id, 10)  # Últimos 10
-    
+    if context.args and context.args[0].lower() == "buscar":
+        await buscar_historial(update, usuario_id, " ".join(context.args[1:]))
+        return
+    texto, botones = await asyncio.to_thread(pagina_historial, usuario_id, 0)
+    await update.message.reply_text(texto, reply_markup=botones)
+
+async def buscar_historial(update: Update, usuario_id: int, termino: str):
+    """Búsqueda de texto completo en el historial del usuario"""
+    if not termino.strip():
+        await update.message.reply_text("🔎 Uso: /historial buscar <texto>\nEjemplo: /historial buscar receta pasta")
+        return
+    registros = await asyncio.to_thread(historial.buscar, usuario_id, termino, 10)
     if not registros:
-        await update.message.reply_text(
-            "📜 **TU HISTORIAL**\n\n"
+        await update.message.reply_text(f"🔎 Nada en tu historial coincide con «{termino}».")
+        return
+
+    lineas = [f"🔎 Resultados para «{termino}»:\n"]
+    for i, r in enumerate(registros, 1):
+        lineas.append(f"{i}. {historial.TIPO_EMOJI.get(r['tipo'], '📄')} {(r['nombre'] or '')[:80]}\n"
+                      f"   📅 {r['fecha']}" + (f"\n   🔗 {r['url'][:100]}" if r.get("url") else ""))
+    await update.message.reply_text("\n".join(lineas)[:config.MAX_MESSAGE_LENGTH])
+
+def pagina_historial(usuario_id: int, numero: int):
+    """
+    Texto y botones de la página `numero` del historial (también la usan los callbacks).
+    Bloqueante (vacía el buffer y lee disco): llamar con asyncio.to_thread.
+    """
+    texto, paginas = historial.mostrar(usuario_id, numero=numero)
+    if not paginas:
+        texto = (
+            "📜 TU HISTORIAL\n\n"
             "🤷‍♂️ Aún no tienes descargas registradas.\n"
             "¡Envía una URL o imagen para empezar!"
         )
-        return
-    
-    # Crear mensaje del historial
-    mensaje = "📜 **TU HISTORIAL** (últimos 10):\n\n"
-    
-    for i, registro in enumerate(registros, 1):
-        tipo_emoji = {
-            "videos": "🎬",
-            "audio": "🎵", 
-            "fotos": "📷",
-            "mangas": "📚",
-            "qr": "🔍",
-            "ocr": "📝",
-            "objetos": "👁️",
-            "metadata": "🌍"
-        }.get(registro["tipo"], "📄")
-        
-        mensaje += f"{i}. {tipo_emoji} **{registro['tipo'].upper()}**\n"
-        mensaje += f"   📁 {registro['nombre']}\n"
-        mensaje += f"   📅 {registro['fecha']}\n"
-        
-        if registro.get('duracion'):
-            mensaje += f"   ⏱️ {registro['duracion']}\n"
-        if registro.get('url'):
-            mensaje += f"   🔗 {registro['url'][:50]}...\n"
-        mensaje += "\n"
-    
-    # Botones adicionales
+        return texto, None
+
+    numero = min(numero, paginas - 1)
+    fila = []
+    if numero > 0:
+        fila.append(InlineKeyboardButton("⬅️ Recientes", callback_data=f"hist_page:{numero - 1}"))
+    if numero < paginas - 1:
+        fila.append(InlineKeyboardButton("➡️ Anteriores", callback_data=f"hist_page:{numero + 1}"))
     keyboard = [
+        fila,
         [
             InlineKeyboardButton("🗑️ Limpiar Historial", callback_data="clear_history"),
             InlineKeyboardButton("📊 Estadísticas", callback_data="history_stats")
         ]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        mensaje,
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    return texto, InlineKeyboardMarkup([f for f in keyboard if f])
 
 async def game_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mini-juegos interactivos"""
@@ -237,14 +241,84 @@ async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Estadísticas del bot (solo admin)"""
     # Aquí puedes agregar verificación de admin
+    cola = download_queue.estado()
+    conversiones = postproceso.ESTADISTICAS_CONVERSION
+    almacen = storage_manager.estadisticas()
+    compactado = compressor.estadisticas()
+    descargas = await asyncio.to_thread(historial.estadisticas)
+    analisis = analisis_cache.estadisticas()
+    tipos = sorted(descargas["tipos"].items(), key=lambda t: t[1], reverse=True)[:5]
+    por_dia = " · ".join(f"{dia[5:]}: {n}" for dia, n in reversed(descargas["dias"]))
     mensaje = (
         "📊 **ESTADÍSTICAS DEL BOT**\n\n"
-        "🚧 *En desarrollo...*\n\n"
-        "Próximamente mostraré:\n"
-        "• Total de usuarios\n"
-        "• Descargas por día\n"
-        "• Uso de recursos\n"
-        "• Módulos más utilizados"
+        f"⬇️ Descargas activas: {cola['activas']}/{cola['workers']}\n"
+        f"📥 En cola: {cola['en_cola']} ({cola['usuarios_esperando']} usuarios)\n"
+        f"🎞️ Conversiones: {conversiones['remux']} remux, "
+        f"{conversiones['video'] + conversiones['audio']} parciales, "
+        f"{conversiones['completa']} completas\n"
+        f"💾 Almacén: {almacen['total_gb']:.1f}/{almacen['limite_gb']} GB, {almacen['archivos']} archivos "
+        f"(política {almacen['politica']})\n"
+        f"🎯 Caché: {almacen['tasa_aciertos']:.0%} aciertos ({almacen['aciertos']}/{almacen['aciertos'] + almacen['fallos']}), "
+        f"{almacen['archivos_evictados']} evictados ({almacen['bytes_evictados'] / (1024 ** 3):.1f} GB)\n"
+        f"🗜️ Compactados: {compactado['comprimidos']} videos fríos "
+        f"({compactado['bytes_ahorrados'] / (1024 ** 3):.1f} GB ahorrados)\n"
+        f"🖼️ Análisis cacheados: {analisis['entradas']} ({analisis['bytes'] / (1024 ** 2):.1f} MB), "
+        f"{analisis['aciertos']} aciertos / {analisis['fallos']} fallos\n\n"
+        f"👥 Usuarios con historial: {descargas['usuarios']}\n"
+        f"📈 Descargas registradas: {descargas['total']} ({descargas['hoy']} hoy)\n"
+        f"📅 Últimos días: {por_dia}\n"
+        f"🏆 Más usados: {', '.join(f'{tipo} ({n})' for tipo, n in tipos) or '—'}"
     )
     
-    await update.message.reply_text(mensaje, parse_mode='Markdown')
\ No newline at end of file
+    await update.message.reply_text(mensaje, parse_mode='Markdown')
+
+# --- Explorador de archivos (admin) ---
+ARCHIVOS_POR_PAGINA = 15
+
+async def archivos_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Explorador paginado de downloads/ (solo admin). Uso: /archivos [categoria]"""
+    if update.message.from_user.id not in config.ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ Comando solo para administradores.")
+        return
+
+    categoria = context.args[0].lower() if context.args else None
+    if categoria and categoria not in storage_manager.CARPETAS:
+        await update.message.reply_text(f"❌ Categoría desconocida. Usa: {', '.join(storage_manager.CARPETAS)}")
+        return
+
+    # Cursores de cada página ya vista, para poder volver atrás
+    context.user_data["archivos"] = {"categoria": categoria, "cursores": [None]}
+    texto, botones = await asyncio.to_thread(pagina_archivos, context, 0)
+    await update.message.reply_text(texto, reply_markup=botones)
+
+def pagina_archivos(context: ContextTypes.DEFAULT_TYPE, numero: int):
+    """
+    Texto y botones de la página `numero` del explorador (también la usan los callbacks).
+    Bloqueante (recorre el índice de storage_manager): llamar con asyncio.to_thread.
+    """
+    estado = context.user_data.get("archivos") or {"categoria": None, "cursores": [None]}
+    cursores = estado["cursores"]
+    numero = min(numero, len(cursores) - 1)
+    archivos, siguiente = storage_manager.listar_pagina(
+        estado["categoria"], cursor=cursores[numero], limite=ARCHIVOS_POR_PAGINA
+    )
+    if siguiente and len(cursores) == numero + 1:
+        cursores.append(siguiente)
+
+    ahora = time.time()
+    lineas = [f"🗂️ ARCHIVOS ({estado['categoria'] or 'todas'}) — página {numero + 1}\n"]
+    for a in archivos:
+        dias = (ahora - a["ultimo_acceso"]) / 86400
+        enlace = " 🔗" if a["compartido"] else ""
+        lineas.append(f"• {os.path.basename(a['ruta'])[:60]}{enlace}\n"
+                      f"   {a['tamaño'] / 1024 ** 2:.1f} MB · {a['accesos']} accesos · hace {dias:.0f} d")
+    if not archivos:
+        lineas.append("🤷‍♂️ No hay archivos.")
+
+    fila = []
+    if numero > 0:
+        fila.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"archivos_pag:{numero - 1}"))
+    if siguiente:
+        fila.append(InlineKeyboardButton("➡️ Siguiente", callback_data=f"archivos_pag:{numero + 1}"))
+    return "\n".join(lineas), InlineKeyboardMarkup([fila]) if fila else None
+
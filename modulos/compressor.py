@@ -0,0 +1,119 @@
+"""
+compressor.py
+Capa fría del almacenamiento: los videos que llevan tiempo sin pedirse se recodifican
+en segundo plano a una versión más ligera (CRF alto, resolución limitada) y sustituyen
+al original de forma atómica. Así caben muchos más medios distintos en STORAGE_LIMIT_GB
+antes de que la eviction tenga que borrar nada.
+Lo lanza periódicamente modulos/mantenimiento.
+"""
+
+import os
+import logging
+
+from modulos import storage_manager, resource_manager, postproceso, derivados, persistencia
+
+logger = logging.getLogger(__name__)
+
+INDICE_PATH = "downloads/.compressor.json"
+CARPETA = storage_manager.CARPETAS["videos"]
+FRIO_DESPUES = 3 * 24 * 3600        # Segundos sin pedirse para considerarlo frío
+TAMAÑO_MINIMO = 20 * 1024 * 1024    # No vale la pena recodificar archivos pequeños
+GANANCIA_MINIMA = 0.15              # Solo se reemplaza si ahorra al menos un 15%
+MAX_POR_RONDA = 3                   # Videos por ejecución, para no acaparar el CPU
+CRF = 30
+ALTURA_MAX = 720
+
+# Cuánto ha compactado (persiste en el índice)
+ESTADISTICAS = {"comprimidos": 0, "descartados": 0, "bytes_ahorrados": 0}
+
+_procesados = None  # ruta -> tamaño tras pasar por aquí (comprimido o descartado)
+
+def _cargar():
+    global _procesados
+    if _procesados is None:
+        datos = persistencia.cargar_json(INDICE_PATH) or {}
+        _procesados = datos.get("procesados", {})
+        ESTADISTICAS.update(datos.get("estadisticas", {}))
+    return _procesados
+
+def _persistir():
+    persistencia.guardar_json(INDICE_PATH, {"procesados": _procesados, "estadisticas": ESTADISTICAS})
+
+def _no_recodificable(ruta: str) -> bool:
+    """
+    Copias tg_ para Telegram y derivados (p. ej. .comprimido.mp4): recodificarlos cambia
+    su hash, file_ids deja de acertar y se vuelven a subir; los derivados además ya van comprimidos.
+    """
+    return os.path.basename(ruta).startswith("tg_") or derivados.es_derivado(ruta)
+
+def comprimir_video(ruta: str, hilos: int = 0) -> int:
+    """
+    Recodifica `ruta` y la reemplaza si la versión nueva ahorra lo suficiente.
+    Devuelve los bytes ahorrados (0 si se descartó).
+    """
+    carpeta, nombre = os.path.split(ruta)
+    # Oculto (punto inicial): storage_manager no lo indexa ni lo evicta mientras se genera
+    temporal = os.path.join(carpeta, f".{nombre}.compactando.mp4")
+    procesados = _cargar()
+    antes = os.path.getsize(ruta)
+
+    with storage_manager.fijados(ruta):
+        try:
+            postproceso.comprimir(ruta, temporal, crf=CRF, altura_max=ALTURA_MAX, hilos=hilos)
+            despues = os.path.getsize(temporal)
+            if despues > antes * (1 - GANANCIA_MINIMA):
+                ESTADISTICAS["descartados"] += 1
+                procesados[ruta] = antes
+                logger.info(f"[compressor] Sin ganancia suficiente, se conserva: {ruta}")
+                return 0
+            # Los hardlinks de la misma ruta quedan comprimidos con ella
+            for hermano in storage_manager.reemplazar_contenido(ruta, temporal):
+                procesados[hermano] = despues
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            _persistir()
+
+    ahorro = antes - despues
+    procesados[ruta] = despues
+    ESTADISTICAS["comprimidos"] += 1
+    ESTADISTICAS["bytes_ahorrados"] += ahorro
+    _persistir()
+    logger.info(f"[compressor] Video comprimido: {ruta} "
+                f"({antes / 1024 ** 2:.1f} MB → {despues / 1024 ** 2:.1f} MB)")
+    return ahorro
+
+def compactar_frios() -> int:
+    """
+    Tarea periódica: comprime hasta MAX_POR_RONDA videos fríos, del más frío al menos.
+    Se detiene si resource_manager no da presupuesto de CPU. Devuelve los bytes ahorrados.
+    """
+    procesados = _cargar()
+    candidatos = [ruta for ruta, tamaño in storage_manager.archivos_frios(CARPETA, FRIO_DESPUES, TAMAÑO_MINIMO,
+                                                                          excluir=_no_recodificable)
+                  if procesados.get(ruta) != tamaño]
+    ahorro = intentos = 0
+    for ruta in candidatos:
+        if intentos >= MAX_POR_RONDA:
+            break
+        if not os.path.exists(ruta) or procesados.get(ruta) == os.path.getsize(ruta):
+            continue  # Ya compactado en esta ronda como hardlink de otro
+        intentos += 1
+        hilos = resource_manager.presupuesto_cpu()
+        if not hilos:
+            break
+        try:
+            ahorro += comprimir_video(ruta, hilos=hilos)
+        except Exception as e:
+            logger.error(f"[compressor] Error comprimiendo {ruta}: {e}")
+            procesados[ruta] = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+            _persistir()
+
+    # Olvida rutas que ya no existen para que el índice no crezca sin fin
+    for ruta in [r for r in procesados if not os.path.exists(r)]:
+        del procesados[ruta]
+    return ahorro
+
+def estadisticas() -> dict:
+    _cargar()
+    return dict(ESTADISTICAS)
@@ -0,0 +1,146 @@
+"""
+derivados.py
+Artefactos derivados de un archivo descargado (audio, miniatura, versión comprimida).
+Se declaran aquí y se generan bajo demanda la primera vez que alguien los pide.
+El resultado queda en una caché ligada al archivo padre: si storage_manager borra
+el padre, sus derivados se borran con él.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from modulos import postproceso, storage_manager, persistencia
+
+logger = logging.getLogger(__name__)
+
+INDICE_PATH = "downloads/.derivados.json"
+
+# nombre -> (carpeta, extensión, tipo de envío en file_ids, constructor(ruta_padre, ruta_salida))
+DERIVADOS = {
+    "audio": ("downloads/audio", "mp3", "audio",
+              lambda padre, salida: postproceso.procesar(padre, salida_audio=salida)),
+    "foto": ("downloads/fotos", "jpg", "foto",
+             lambda padre, salida: postproceso.procesar(padre, salida_foto=salida)),
+    "comprimido": ("downloads/videos", "mp4", "video",
+                   lambda padre, salida: postproceso.comprimir(padre, salida)),
+}
+
+_lock = threading.Lock()
+_indice = None   # {"padres": {ref: ruta_padre}, "derivados": {ruta_padre: {nombre: ruta}}}
+_en_curso = {}   # (ruta_padre, nombre) -> Future compartido por las peticiones simultáneas
+
+def _cargar():
+    global _indice
+    if _indice is None:
+        _indice = {"padres": {}, "derivados": {}, **(persistencia.cargar_json(INDICE_PATH) or {})}
+    return _indice
+
+def _persistir():
+    persistencia.guardar_json(INDICE_PATH, _indice)
+
+def referencia(ruta_padre: str) -> str:
+    """Identificador corto del padre, apto para callback_data (máx. 64 bytes)"""
+    ruta_padre = os.path.abspath(ruta_padre)
+    ref = hashlib.sha1(ruta_padre.encode()).hexdigest()[:12]
+    with _lock:
+        padres = _cargar()["padres"]
+        if padres.get(ref) != ruta_padre:
+            padres[ref] = ruta_padre
+            _persistir()
+    return ref
+
+def ruta_de_referencia(ref: str):
+    """Ruta del padre o None si ya no existe"""
+    with _lock:
+        ruta = _cargar()["padres"].get(ref)
+    return ruta if ruta and os.path.exists(ruta) else None
+
+def es_derivado(ruta: str) -> bool:
+    """True si `ruta` fue generada aquí a partir de otro archivo"""
+    ruta = os.path.abspath(ruta)
+    with _lock:
+        return any(os.path.abspath(d) == ruta
+                   for hijos in _cargar()["derivados"].values() for d in hijos.values())
+
+def tipo_envio(nombre: str) -> str:
+    return DERIVADOS[nombre][2]
+
+def _construir(ruta_padre: str, nombre: str) -> str:
+    carpeta, ext, _, constructor = DERIVADOS[nombre]
+    base = os.path.splitext(os.path.basename(ruta_padre))[0]
+    salida = os.path.join(carpeta, f"{base}.{nombre}.{ext}")
+    os.makedirs(carpeta, exist_ok=True)
+    constructor(ruta_padre, salida)
+    if not os.path.exists(salida):
+        raise RuntimeError(f"No se pudo generar {nombre} de {ruta_padre}")
+    storage_manager.registrar_archivo(salida)
+    logger.info(f"[derivados] {nombre} generado bajo demanda: {salida}")
+    return salida
+
+def obtener(ruta_padre: str, nombre: str) -> str:
+    """
+    Devuelve la ruta del derivado `nombre` de `ruta_padre`, generándolo si hace falta.
+    Bloqueante (ffmpeg): llamar desde un hilo o desde download_queue.
+    Peticiones simultáneas del mismo derivado esperan a una sola generación.
+    """
+    if nombre not in DERIVADOS:
+        raise ValueError(f"Derivado desconocido: {nombre}")
+    ruta_padre = os.path.abspath(ruta_padre)
+    clave = (ruta_padre, nombre)
+
+    with _lock:
+        existente = _cargar()["derivados"].get(ruta_padre, {}).get(nombre)
+        if existente and os.path.exists(existente):
+            return existente
+        futuro = _en_curso.get(clave)
+        propietario = futuro is None
+        if propietario:
+            futuro = _en_curso[clave] = Future()
+
+    if not propietario:
+        return futuro.result()
+
+    try:
+        salida = _construir(ruta_padre, nombre)
+        with _lock:
+            _cargar()["derivados"].setdefault(ruta_padre, {})[nombre] = salida
+            _persistir()
+        futuro.set_result(salida)
+        return salida
+    except Exception as e:
+        futuro.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _en_curso.pop(clave, None)
+
+def invalidar_ruta(ruta: str) -> list:
+    """
+    Llamado por storage_manager al borrar un archivo.
+    Si era un padre, borra también sus derivados y devuelve sus rutas;
+    si era un derivado, solo lo olvida.
+    """
+    ruta = os.path.abspath(ruta)
+    borrados = []
+    with _lock:
+        indice = _cargar()
+        hijos = indice["derivados"].pop(ruta, None)
+        if hijos is not None:
+            for derivado in hijos.values():
+                try:
+                    os.remove(derivado)
+                    borrados.append(derivado)
+                except OSError:
+                    pass
+        else:
+            for hijos in indice["derivados"].values():
+                for nombre in [n for n, d in hijos.items() if os.path.abspath(d) == ruta]:
+                    del hijos[nombre]
+        refs = [r for r, p in indice["padres"].items() if p == ruta]
+        for ref in refs:
+            del indice["padres"][ref]
+        if hijos is not None or refs:
+            _persistir()
+    return borrados
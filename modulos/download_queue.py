@@ -0,0 +1,136 @@
+"""
+download_queue.py
+Cola de trabajos de descarga con pool de workers acotado fuera del event loop.
+Reparte los turnos entre usuarios en round-robin para que nadie acapare el pool.
+"""
+
+import asyncio
+import logging
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = config.MAX_PARALLEL_DOWNLOADS
+
+# Pool de hilos donde corren yt-dlp, ffmpeg y los movimientos de archivos
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="descarga")
+
+# Trabajos pendientes por usuario y orden de turnos (round-robin)
+_colas = {}        # usuario_id -> deque[(func, args, kwargs, futuro)]
+_turnos = deque()  # usuario_id con trabajos pendientes, en orden de atención
+_activas = 0       # Trabajos ejecutándose ahora mismo
+_en_vuelo = {}     # clave -> Future del trabajo en curso (single-flight)
+
+# Se crean al primer uso para quedar ligados al loop de la aplicación
+_pendientes = None  # asyncio.Semaphore que cuenta trabajos en cola
+_workers = []
+
+def _asegurar_workers():
+    """Arranca los workers la primera vez que se encola algo"""
+    global _pendientes
+    if _workers:
+        return
+    _pendientes = asyncio.Semaphore(0)
+    for i in range(MAX_WORKERS):
+        _workers.append(asyncio.create_task(_worker(i), name=f"download_worker_{i}"))
+    logger.info(f"[download_queue] {MAX_WORKERS} workers de descarga iniciados")
+
+def _siguiente_trabajo():
+    """Saca el siguiente trabajo respetando el turno de cada usuario"""
+    usuario_id = _turnos.popleft()
+    cola = _colas[usuario_id]
+    trabajo = cola.popleft()
+    if cola:
+        _turnos.append(usuario_id)  # Vuelve al final de la fila
+    else:
+        del _colas[usuario_id]
+    return trabajo
+
+async def _worker(numero: int):
+    """Consume trabajos de la cola y los ejecuta en el pool de hilos"""
+    global _activas
+    loop = asyncio.get_running_loop()
+    while True:
+        await _pendientes.acquire()
+        func, args, kwargs, futuro = _siguiente_trabajo()
+        if futuro.cancelled():
+            continue
+
+        _activas += 1
+        try:
+            resultado = await loop.run_in_executor(
+                executor, functools.partial(func, *args, **kwargs)
+            )
+            if not futuro.cancelled():
+                futuro.set_result(resultado)
+        except Exception as e:
+            logger.error(f"[download_queue] Worker {numero} falló: {e}")
+            if not futuro.cancelled():
+                futuro.set_exception(e)
+        finally:
+            _activas -= 1
+
+def encolar(usuario_id: int, func, *args, **kwargs) -> asyncio.Future:
+    """
+    Encola una función bloqueante para ejecutarla en el pool de descargas.
+    Devuelve un Future que se resuelve con el resultado de la función.
+    """
+    _asegurar_workers()
+    futuro = asyncio.get_running_loop().create_future()
+
+    cola = _colas.get(usuario_id)
+    if cola is None:
+        cola = _colas[usuario_id] = deque()
+        _turnos.append(usuario_id)
+    cola.append((func, args, kwargs, futuro))
+
+    _pendientes.release()
+    return futuro
+
+def encolar_unico(clave: str, usuario_id: int, func, *args, **kwargs):
+    """
+    Como encolar, pero coalesciendo trabajos idénticos (single-flight).
+    Si ya hay un trabajo en curso con la misma clave, no se encola otro:
+    se espera el mismo resultado. Devuelve (awaitable, compartido).
+    """
+    futuro = _en_vuelo.get(clave)
+    compartido = futuro is not None
+    if compartido:
+        logger.info(f"[download_queue] Usuario {usuario_id} se une a la descarga en curso: {clave}")
+    else:
+        futuro = _en_vuelo[clave] = encolar(usuario_id, func, *args, **kwargs)
+        futuro.add_done_callback(lambda f: _en_vuelo.pop(clave, None))
+    # shield: si un usuario cancela su espera, el trabajo sigue para los demás
+    return asyncio.shield(futuro), compartido
+
+def posicion(usuario_id: int) -> int:
+    """
+    Posición en la cola del último trabajo encolado por el usuario (1 = el siguiente).
+    Devuelve 0 si el usuario no tiene trabajos esperando.
+    """
+    cola = _colas.get(usuario_id)
+    if not cola:
+        return 0
+    # Sale en la ronda `ronda` del round-robin: antes pasan sus propios trabajos anteriores
+    # y, de cada otro usuario, uno por ronda (uno más si le toca antes en esa misma ronda)
+    ronda = len(cola) - 1
+    delante = ronda
+    turno = list(_turnos).index(usuario_id)
+    for i, otro in enumerate(_turnos):
+        if otro != usuario_id:
+            delante += min(len(_colas[otro]), ronda + 1 if i < turno else ronda)
+    return delante + 1
+
+def estado() -> dict:
+    """Profundidad de la cola para mostrar al usuario o en /stats"""
+    return {
+        "en_cola": sum(len(c) for c in _colas.values()),
+        "usuarios_esperando": len(_colas),
+        "activas": _activas,
+        "compartidas": len(_en_vuelo),
+        "workers": MAX_WORKERS,
+    }
@@ -1,10 +1,16 @@
 import os
 import re
+import copy
+import time
+import threading
 import unicodedata
+from contextlib import contextmanager
 import logging
-from modulos import historial, storage_manager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from modulos import historial, storage_manager, media_cache
 from modulos import chunked_downloader
 from modulos import parallel_downloader
+from modulos import postproceso
 import yt_dlp
 
 logger = logging.getLogger(__name__)
@@ -22,6 +28,20 @@ for ruta in RUTAS.values():
 # Tamaño máximo para descarga normal antes de usar chunked (en bytes)
 MAX_SIZE_NORMAL = 50 * 1024 * 1024  # 50 MB
 
+# Caché de metadata de yt-dlp (las URLs de formato caducan, por eso el TTL es corto)
+INFO_TTL = 300  # Segundos
+INFO_CACHE_MAX = 256
+_info_cache = {}  # url normalizada -> (expira, info)
+_info_lock = threading.Lock()
+
+# Una sola descarga a la vez por medio (misma clave canónica aunque lleguen URLs distintas)
+_locks_medio = {}  # clave -> [threading.Lock, hilos que lo usan]
+_locks_lock = threading.Lock()
+
+# Parámetros de tracking que no cambian el contenido
+PARAMS_TRACKING = {"si", "igshid", "igsh", "fbclid", "gclid", "feature", "_t", "_r",
+                   "is_from_webapp", "sender_device", "share_id", "ref"}
+
 def nombre_seguro(nombre_original: str) -> str:
     nombre = unicodedata.normalize('NFKD', nombre_original).encode('ascii', 'ignore').decode('ascii')
     nombre = re.sub(r'[^\w.-]', '_', nombre)
@@ -59,68 +79,194 @@ def limpiar_url_tiktok(url: str) -> str:
             return url.split('?')[0]
     return url
 
+def normalizar_url(url: str) -> str:
+    """Forma canónica de una URL para usarla como clave de caché"""
+    partes = urlsplit(url.strip())
+    host = partes.netloc.lower()
+    for prefijo in ("www.", "m."):
+        if host.startswith(prefijo):
+            host = host[len(prefijo):]
+    query = sorted(
+        (k, v) for k, v in parse_qsl(partes.query, keep_blank_values=True)
+        if k not in PARAMS_TRACKING and not k.startswith("utm_")
+    )
+    ruta = partes.path.rstrip("/") or "/"
+    return urlunsplit(("https", host, ruta, urlencode(query), ""))
+
+def extraer_info(url: str, ydl_opts: dict):
+    """
+    Extrae la metadata de yt-dlp una sola vez por URL.
+    Reutiliza el resultado durante INFO_TTL segundos para reintentos y peticiones repetidas.
+    """
+    clave = normalizar_url(url)
+    ahora = time.monotonic()
+    with _info_lock:
+        entrada = _info_cache.get(clave)
+        if entrada and entrada[0] > ahora:
+            logger.info(f"[downloader] Metadata en caché para {clave}")
+            return copy.deepcopy(entrada[1])
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if not info:
+        return None
+    info = yt_dlp.YoutubeDL.sanitize_info(info)
+
+    with _info_lock:
+        # Purga de entradas caducadas y tope de tamaño
+        for k in [k for k, (expira, _) in _info_cache.items() if expira <= ahora]:
+            del _info_cache[k]
+        if len(_info_cache) >= INFO_CACHE_MAX:
+            del _info_cache[min(_info_cache, key=lambda k: _info_cache[k][0])]
+        _info_cache[clave] = (ahora + INFO_TTL, info)
+    return copy.deepcopy(info)
+
+@contextmanager
+def _lock_medio(clave: str):
+    """Serializa las descargas de un mismo medio; el lock se descarta al quedar libre"""
+    with _locks_lock:
+        entrada = _locks_medio.setdefault(clave, [threading.Lock(), 0])
+        entrada[1] += 1
+    try:
+        with entrada[0]:
+            yield
+    finally:
+        with _locks_lock:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del _locks_medio[clave]
+
+def _resultado_cache(entrada: dict, usuario_id: int, url: str):
+    """Respuesta para un medio que ya estaba descargado: directo al paso de envío"""
+    logger.info(f"[downloader] Servido desde media_cache: {entrada['titulo']}")
+    storage_manager.registrar_acceso(entrada['file_path'], *entrada.get('derivados', {}).values())
+    historial.registrar(usuario_id, entrada['titulo'], tipo=entrada['file_type'], url=url,
+                        duracion=entrada.get('duracion', 0))
+    return {
+        'status': 'success',
+        'message': f"{entrada['file_type'].capitalize()} descargado: {entrada['titulo']}",
+        'file_path': entrada['file_path'],
+        'file_type': entrada['file_type'],
+        'clave': entrada['clave'],
+        'derivados': entrada.get('derivados', {}),
+        'titulo': entrada['titulo'],
+        'duracion': entrada.get('duracion', 0),
+        'cache': True
+    }
+
+def desde_cache(url: str, usuario_id: int):
+    """
+    Resultado listo para enviar si la URL ya está en media_cache, o None.
+    Solo consulta el índice: se puede llamar antes de encolar la descarga.
+    """
+    url = limpiar_url_tiktok(url)
+    cacheado = media_cache.buscar(normalizar_url(url))
+    return _resultado_cache(cacheado, usuario_id, url) if cacheado else None
+
 def descargar(url: str, usuario_id: int):
     """Descarga videos, audio o fotos de cualquier red social, usando chunked si es grande."""
     try:
+        # Acierto por URL: sin extracción ni descarga
+        resultado = desde_cache(url, usuario_id)
+        if resultado:
+            return resultado
+
         url = limpiar_url_tiktok(url)
+        url_normalizada = normalizar_url(url)
 
         ydl_opts = {
-            'outtmpl': os.path.join('downloads', '%(title)s.%(ext)s'),
+            # Nombre temporal por extractor+id: único por medio y estable para reanudar
+            'outtmpl': os.path.join('downloads', '%(extractor_key)s_%(id)s.%(ext)s'),
             'format': 'bestvideo+bestaudio/best',
             'merge_output_format': 'mp4',
             'noplaylist': True,
+            'continuedl': True,  # Reanudar los .part de yt-dlp tras un corte
             'quiet': False,
             'progress_hooks': [hook_progreso],
             'http_headers': {'User-Agent': 'Mozilla/5.0'}
         }
 
-        # Primero extraemos info para tamaño y metadata
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if not info:
-                return {"status": "error", "message": "No se pudo extraer información."}
-            tamaño_est = info.get('filesize') or info.get('filesize_approx', 0)
-
-        # Usar chunked si es muy grande
-        if tamaño_est > MAX_SIZE_NORMAL:
-            logger.info(f"[downloader] Video muy grande, usando chunked downloader.")
-            archivo_descargado = chunked_downloader.descargar(url, ydl_opts)
-        else:
-            # Descarga normal con soporte paralelo si se desea
-            archivo_descargado = parallel_downloader.descargar(url, ydl_opts)
-
-        # Saneamiento de nombre
-        titulo = info.get('title', 'archivo_desconocido')
-        nombre_final = nombre_seguro(titulo)
-        ext = os.path.splitext(archivo_descargado)[1].lstrip('.')
-        categoria = detectar_categoria(ext)
-        ruta_destino = os.path.join(RUTAS[categoria], f"{nombre_final}.{ext}")
-
-        if archivo_descargado != ruta_destino:
-            os.rename(archivo_descargado, ruta_destino)
-
-        # Guardar en storage y historial
-        storage_manager.guardar_archivo(ruta_destino, categoria)
-        historial.registrar(usuario_id, titulo, tipo=categoria, url=url, duracion=info.get('duration', 0))
+        # Primero extraemos info para tamaño y metadata (se reutiliza para la descarga)
+        info = extraer_info(url, ydl_opts)
+        if not info:
+            return {"status": "error", "message": "No se pudo extraer información."}
 
-        # Extraer audio o fotos si es video
-        if categoria == "videos":
-            audio_path = os.path.join(RUTAS['audio'], f"{nombre_final}.mp3")
-            parallel_downloader.extraer_audio(ruta_destino, audio_path)
-            # Opcional: extraer fotogramas / miniaturas
-            foto_path = os.path.join(RUTAS['fotos'], f"{nombre_final}.jpg")
-            parallel_downloader.extraer_foto(ruta_destino, foto_path)
-
-        return {
-            'status': 'success',
-            'message': f"{categoria.capitalize()} descargado: {titulo}",
-            'file_path': ruta_destino,
-            'file_type': categoria
-        }
+        # Otra URL del mismo video (enlace corto, mirror...): mismo extractor e id
+        clave = media_cache.clave_de(info, url_normalizada)
+        with _lock_medio(clave):
+            # Tras esperar el lock, otra URL del mismo medio puede haberlo dejado listo
+            cacheado = media_cache.buscar_clave(clave, url_normalizada)
+            if cacheado:
+                return _resultado_cache(cacheado, usuario_id, url)
+            return _descargar_medio(url, url_normalizada, clave, info, ydl_opts, usuario_id)
 
     except yt_dlp.utils.DownloadError as e:
         logger.error(f"[downloader] Error de descarga: {str(e)}")
         return {'status': 'error', 'message': str(e)}
     except Exception as e:
         logger.error(f"[downloader] Error inesperado con {url}: {str(e)}")
-        return {'status': 'error', 'message': str(e)}
\ No newline at end of file
+        return {'status': 'error', 'message': str(e)}
+
+def _descargar_medio(url: str, url_normalizada: str, clave: str, info: dict, ydl_opts: dict, usuario_id: int):
+    """Descarga, organiza y post-procesa un medio que no estaba en media_cache"""
+    storage_manager.registrar_fallo()
+    tamaño_est = info.get('filesize') or info.get('filesize_approx') or 0
+
+    # Usar chunked si es muy grande
+    if tamaño_est > MAX_SIZE_NORMAL:
+        logger.info(f"[downloader] Video muy grande, usando chunked downloader.")
+        archivo_descargado = chunked_downloader.descargar(url, ydl_opts, info=info)
+    else:
+        # Descarga normal con soporte paralelo si se desea
+        archivo_descargado = parallel_downloader.descargar(url, ydl_opts, info=info)
+
+    # Saneamiento de nombre
+    titulo = info.get('title', 'archivo_desconocido')
+    # El id evita que dos medios con el mismo título se pisen
+    nombre_final = nombre_seguro(titulo)[:80]
+    if info.get('id'):
+        nombre_final = f"{nombre_final}_{nombre_seguro(str(info['id']))}"
+    ext = os.path.splitext(archivo_descargado)[1].lstrip('.')
+    categoria = detectar_categoria(ext)
+    ruta_destino = os.path.join(RUTAS[categoria], f"{nombre_final}.{ext}")
+
+    if archivo_descargado != ruta_destino:
+        os.replace(archivo_descargado, ruta_destino)
+
+    # Fijado mientras se post-procesa: la limpieza no puede llevárselo a medias
+    with storage_manager.fijados(ruta_destino):
+        # Guardar en storage y historial
+        ruta_destino = storage_manager.guardar_archivo(ruta_destino, categoria)
+        historial.registrar(usuario_id, titulo, tipo=categoria, url=url, duracion=info.get('duration', 0))
+
+        # Si es video: solo el MP4 para Telegram. Audio, miniatura y demás
+        # derivados se generan bajo demanda (modulos/derivados.py)
+        derivados = {}
+        if categoria == "videos":
+            try:
+                salidas = postproceso.procesar(
+                    ruta_destino,
+                    salida_mp4=os.path.join(RUTAS['videos'], f"tg_{nombre_final}.{ext}.mp4"),
+                    info=info
+                )
+                if os.path.exists(salidas.get('mp4', '')):
+                    derivados['tg'] = salidas['mp4']
+                    storage_manager.registrar_archivo(salidas['mp4'])
+            except Exception as e:
+                logger.error(f"[downloader] Error en post-procesado de {ruta_destino}: {e}")
+
+    # Disponible para el resto de usuarios que pidan el mismo medio
+    media_cache.guardar(clave, url_normalizada, ruta_destino, categoria, titulo,
+                        duracion=info.get('duration', 0), derivados=derivados)
+
+    return {
+        'status': 'success',
+        'message': f"{categoria.capitalize()} descargado: {titulo}",
+        'file_path': ruta_destino,
+        'file_type': categoria,
+        'clave': clave,
+        'derivados': derivados,
+        'titulo': titulo,
+        'duracion': info.get('duration', 0),
+        'codecs': {'vcodec': info.get('vcodec'), 'acodec': info.get('acodec')}
+    }
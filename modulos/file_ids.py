@@ -0,0 +1,135 @@
+"""
+file_ids.py
+Índice persistente hash de contenido -> file_id de Telegram, por tipo de medio.
+Si un archivo ya se subió una vez, se reenvía por file_id: cero bytes de subida.
+"""
+
+import os
+import json
+import atexit
+import asyncio
+import hashlib
+import logging
+import weakref
+import threading
+from telegram.error import BadRequest
+from modulos import persistencia
+
+logger = logging.getLogger(__name__)
+
+INDICE_PATH = "downloads/.file_ids.json"
+BLOQUE_HASH = 1024 * 1024
+MAX_HASHES_MEMORIA = 10000
+PERSISTIR_CADA = 2  # Segundos: el índice se escribe fuera del event loop y agrupando cambios
+
+# tipo -> (método de Message para responder, parámetro/atributo del adjunto)
+TIPOS = {
+    "video": ("reply_video", "video"),
+    "audio": ("reply_audio", "audio"),
+    "foto": ("reply_photo", "photo"),
+    "sticker": ("reply_sticker", "sticker"),
+    "documento": ("reply_document", "document"),
+}
+
+_indice = None  # tipo -> {hash: file_id}
+_hashes = {}    # (ruta absoluta, tamaño, mtime_ns) -> hash, evita rehashear el mismo archivo
+_locks = weakref.WeakValueDictionary()  # (tipo, hash) -> asyncio.Lock
+_lock = threading.Lock()  # Protege _indice frente al hilo que lo persiste
+_temporizador = None
+
+def _cargar():
+    global _indice
+    if _indice is not None:
+        return _indice
+    _indice = {tipo: {} for tipo in TIPOS}
+    _indice.update(persistencia.cargar_json(INDICE_PATH) or {})
+    return _indice
+
+def _persistir():
+    global _temporizador
+    with _lock:
+        _temporizador = None
+        datos = json.dumps(_indice)
+    persistencia.escribir_atomico(INDICE_PATH, datos)
+
+def _persistir_pronto():
+    """Agenda la escritura del índice en un hilo (llamar con _lock); varios cambios se guardan juntos"""
+    global _temporizador
+    if _temporizador is None:
+        _temporizador = threading.Timer(PERSISTIR_CADA, _persistir)
+        _temporizador.daemon = True
+        _temporizador.start()
+
+@atexit.register
+def _persistir_al_salir():
+    if _temporizador is not None:
+        _temporizador.cancel()
+        _persistir()
+
+def hash_contenido(ruta: str) -> str:
+    """SHA-256 del archivo en streaming, memorizado por ruta+tamaño+mtime"""
+    st = os.stat(ruta)
+    clave = (os.path.abspath(ruta), st.st_size, st.st_mtime_ns)
+    if clave in _hashes:
+        return _hashes[clave]
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(BLOQUE_HASH), b""):
+            h.update(bloque)
+    digest = h.hexdigest()
+    if len(_hashes) >= MAX_HASHES_MEMORIA:
+        _hashes.clear()
+    _hashes[clave] = digest
+    return digest  # No se relee de _hashes: otro hilo puede vaciarlo entre medias
+
+def obtener(tipo: str, digest: str):
+    return _cargar()[tipo].get(digest)
+
+def recordar(tipo: str, digest: str, file_id: str):
+    _cargar()
+    with _lock:
+        _indice[tipo][digest] = file_id
+        _persistir_pronto()
+
+def olvidar(tipo: str, digest: str):
+    _cargar()
+    with _lock:
+        if _indice[tipo].pop(digest, None):
+            _persistir_pronto()
+
+def _file_id_de(enviado, atributo: str):
+    """Extrae el file_id del mensaje que devolvió Telegram tras la subida"""
+    adjunto = getattr(enviado, atributo, None)
+    if atributo == "photo" and adjunto:
+        adjunto = adjunto[-1]  # La resolución más grande
+    return adjunto.file_id if adjunto else None
+
+async def enviar(mensaje, tipo: str, ruta: str, **kwargs):
+    """
+    Responde a `mensaje` con el archivo de `ruta` como `tipo` (video, audio, foto, sticker, documento).
+    Usa el file_id guardado si el contenido ya se subió; si no, sube y guarda el file_id.
+    kwargs se pasan tal cual al método reply_* (caption, reply_markup...).
+    """
+    metodo, atributo = TIPOS[tipo]
+    responder = getattr(mensaje, metodo)
+    digest = await asyncio.to_thread(hash_contenido, ruta)
+
+    # Un solo envío a la vez por contenido: los siguientes reutilizan el file_id del primero
+    lock = _locks.get((tipo, digest))
+    if lock is None:
+        lock = _locks[(tipo, digest)] = asyncio.Lock()
+    async with lock:
+        file_id = obtener(tipo, digest)
+        if file_id:
+            try:
+                return await responder(**{atributo: file_id}, **kwargs)
+            except BadRequest as e:
+                logger.warning(f"[file_ids] file_id inválido para {ruta}, se vuelve a subir: {e}")
+                olvidar(tipo, digest)
+
+        with open(ruta, "rb") as f:
+            enviado = await responder(**{atributo: f}, **kwargs)
+        file_id = _file_id_de(enviado, atributo)
+        if file_id:
+            recordar(tipo, digest, file_id)
+        return enviado
@@ -2,24 +2,435 @@
 historial.py
 Mantiene un registro completo de descargas por usuario.
 Compatible con videos, fotos, mangas, QR y más.
+Cada usuario tiene un diario append-only (<usuario_id>.jsonl, un registro por línea);
+con config.USE_DATABASE (DATABASE_URL de SQLite) los registros van a modulos/historial_sqlite.
 """
 
 import os
 import json
-from datetime import datetime
+import atexit
+import logging
+import threading
+from array import array
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
 
-HISTORIAL_PATH = "downloads/historial/"  # Carpeta donde se guardan archivos JSON
+import config
+from modulos import historial_sqlite, historial_busqueda, persistencia
+
+logger = logging.getLogger(__name__)
+
+HISTORIAL_PATH = "downloads/historial/"  # Carpeta donde se guardan los diarios JSONL
+FSYNC_CADA = 0  # fsync tras cada N registros por usuario (0 = lo decide el sistema operativo)
+FLUSH_CADA = 1.0        # Segundos máximos que un registro espera en el buffer
+LOTE = 200              # Registros pendientes que disparan un volcado inmediato
+MAX_PENDIENTES = 10000  # Tope del buffer: registrar espera si se llena (backpressure)
+CACHE_USUARIOS = 256    # Usuarios con sus últimos registros en memoria
+CACHE_REGISTROS = 50    # Registros recientes guardados por usuario
+BLOQUE_COLA = 8192      # Bytes leídos por paso al recorrer un diario desde el final
+ROLLUPS_PATH = os.path.join(HISTORIAL_PATH, "_rollups.json")
+DIAS_ROLLUP = 90        # Días con contador propio; los más viejos solo cuentan en el total
+POR_PAGINA = 10         # Registros por página en mostrar()
+BUSQUEDA_PATH = os.path.join(HISTORIAL_PATH, ".busqueda.db")
+
+# Retención de los registros de poco valor: tipo -> (días máximos, registros máximos por usuario)
+# 0 = sin límite en esa dimensión. Los tipos que no aparecen solo cuentan para el tope por usuario.
+RETENCION = {
+    "metadata": (30, 100),
+    "safety": (30, 100),
+    "objetos": (30, 100),
+    "ocr": (90, 200),
+    "qr": (90, 300),
+}
+MAX_REGISTROS_USUARIO = 5000  # Tope total por usuario; se conservan los más recientes
 
 # Crear carpeta si no existe
 os.makedirs(HISTORIAL_PATH, exist_ok=True)
 
+_locks = {}          # usuario_id -> threading.Lock (escrituras y compactación del mismo diario)
+_locks_lock = threading.Lock()
+_sin_fsync = {}      # usuario_id -> registros escritos desde el último fsync
+_migrado = False
+_migracion_lock = threading.Lock()
+
+# Buffer write-behind
+_pendientes = deque()              # (usuario_id, registro) en orden de llegada
+_cond = threading.Condition()      # Protege _pendientes; avisa al volcador y a productores en espera
+_volcado_lock = threading.Lock()   # Un solo lote escribiéndose a la vez: conserva el orden
+_volcador = None
+
+# Caché LRU de registros recientes: usuario_id -> (deque de los últimos, completo)
+# completo = al cargarla el usuario tenía menos registros que los pedidos (vale mientras no se llene)
+_recientes = OrderedDict()
+_recientes_lock = threading.Lock()  # También ordena registrar frente a la carga de la caché
+
+# Contadores agregados. total/tipos/dias cuentan descargas hechas (limpiar no las descuenta);
+# usuarios solo tiene a quien conserva historial: {usuario_id: {"total", "tipos", "ultima"}}
+_rollups = None
+_rollups_lock = threading.Lock()
+_rollups_sucio = False
+
+# Backend SQLite si está configurado; None = diarios JSONL
+_db = historial_sqlite if config.USE_DATABASE and historial_sqlite.configurar(config.DATABASE_URL) else None
+# Índice de texto completo; None = este SQLite no tiene FTS5 y buscar() recorre el historial
+_busqueda = historial_busqueda if historial_busqueda.configurar(BUSQUEDA_PATH) else None
+
 def _ruta_usuario(usuario_id: int):
-    """Ruta del archivo JSON de un usuario"""
-    return os.path.join(HISTORIAL_PATH, f"{usuario_id}.json")
+    """Ruta del diario JSONL de un usuario"""
+    return os.path.join(HISTORIAL_PATH, f"{usuario_id}.jsonl")
+
+def _ruta_indice(usuario_id: int):
+    """Índice de offsets del diario: inicio de cada línea y, al final, el tamaño ya indexado"""
+    return os.path.join(HISTORIAL_PATH, f"{usuario_id}.idx")
+
+def _lock_usuario(usuario_id: int) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(str(usuario_id), threading.Lock())
+
+def _migrar():
+    """
+    Migración única desde el formato anterior (<usuario_id>.json con un array indentado).
+    El archivo viejo se conserva como .json.migrado por si hay que volver atrás.
+    """
+    global _migrado
+    if _migrado:
+        return
+    with _migracion_lock:
+        if not _migrado:
+            _migrar_json()
+            if _db:
+                _migrar_a_db()
+            if _busqueda and not _busqueda.construido():
+                _construir_busqueda()
+            _migrado = True
+
+def _migrar_json():
+    for nombre in os.listdir(HISTORIAL_PATH):
+        if not nombre.endswith(".json") or nombre.startswith(("_", ".")):
+            continue
+        usuario_id = nombre[:-len(".json")]
+        ruta_vieja = os.path.join(HISTORIAL_PATH, nombre)
+        try:
+            with open(ruta_vieja, "r", encoding="utf-8") as f:
+                registros = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[historial] No se pudo migrar {ruta_vieja}: {e}")
+            continue
+        with _lock_usuario(usuario_id):
+            # Lo ya escrito en el diario es posterior al archivo viejo: va detrás
+            _reescribir(usuario_id, registros + _leer(usuario_id))
+        os.replace(ruta_vieja, ruta_vieja + ".migrado")
+        logger.info(f"[historial] Migrado {nombre}: {len(registros)} registros")
+
+def _migrar_a_db():
+    """Al activar SQLite con la base vacía, importa los diarios JSONL existentes"""
+    if not _db.vacia():
+        return
+    for nombre in os.listdir(HISTORIAL_PATH):
+        if not nombre.endswith(".jsonl"):
+            continue
+        usuario_id = nombre[:-len(".jsonl")]
+        registros = _leer(usuario_id)
+        _db.anexar(usuario_id, registros)
+        os.replace(_ruta_usuario(usuario_id), _ruta_usuario(usuario_id) + ".migrado")
+        if os.path.exists(_ruta_indice(usuario_id)):
+            os.remove(_ruta_indice(usuario_id))
+        logger.info(f"[historial] {nombre} importado a SQLite: {len(registros)} registros")
+
+def _construir_busqueda():
+    """Primera vez con el índice de búsqueda: indexa todo lo que ya hay guardado"""
+    if _db:
+        registros = ((uid, _db.obtener(uid)) for uid in _db.usuarios())
+    else:
+        registros = ((n[:-len(".jsonl")], _leer(n[:-len(".jsonl")]))
+                     for n in os.listdir(HISTORIAL_PATH) if n.endswith(".jsonl"))
+    try:
+        _busqueda.construir(registros)
+    except Exception as e:
+        logger.error(f"[historial] No se pudo construir el índice de búsqueda: {e}")
+
+def _linea(registro: dict) -> str:
+    return json.dumps(registro, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def _anexar(usuario_id: int, registros: list):
+    """Añade registros al final del diario en una sola escritura"""
+    if _db:
+        return _db.anexar(usuario_id, registros)
+    lineas = [_linea(r).encode("utf-8") for r in registros]
+    with _lock_usuario(usuario_id):
+        with open(_ruta_usuario(usuario_id), "ab") as f:
+            inicio = f.tell()
+            f.write(b"".join(lineas))
+            _extender_indice(usuario_id, inicio, lineas)
+            if FSYNC_CADA:
+                clave = str(usuario_id)
+                _sin_fsync[clave] = _sin_fsync.get(clave, 0) + len(registros)
+                if _sin_fsync[clave] >= FSYNC_CADA:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    _sin_fsync[clave] = 0
+
+def _leer(usuario_id: int) -> list:
+    """Lee el diario completo; una última línea a medias (corte de luz) se ignora"""
+    ruta = _ruta_usuario(usuario_id)
+    if not os.path.exists(ruta):
+        return []
+    registros = []
+    with open(ruta, "r", encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registros.append(json.loads(linea))
+            except ValueError:
+                logger.warning(f"[historial] Línea corrupta ignorada en {ruta}")
+    return registros
+
+def _leer_cola(usuario_id: int, n: int) -> list:
+    """Últimos n registros leyendo bloques desde el final del diario, sin parsear el resto"""
+    ruta = _ruta_usuario(usuario_id)
+    if n <= 0 or not os.path.exists(ruta):
+        return []
+    with _lock_usuario(usuario_id), open(ruta, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        posicion = f.tell()
+        datos = b""
+        # n + 1 saltos de línea garantizan n líneas completas al final
+        while posicion > 0 and datos.count(b"\n") <= n:
+            paso = min(BLOQUE_COLA, posicion)
+            posicion -= paso
+            f.seek(posicion)
+            datos = f.read(paso) + datos
+    lineas = datos.split(b"\n")
+    if posicion > 0:
+        lineas = lineas[1:]  # La primera puede estar cortada por el bloque
+    registros = []
+    for linea in reversed(lineas):
+        if len(registros) >= n:
+            break
+        if not linea.strip():
+            continue
+        try:
+            registros.append(json.loads(linea))
+        except ValueError:
+            logger.warning(f"[historial] Línea corrupta ignorada en {ruta}")
+    registros.reverse()
+    return registros
+
+def _reescribir(usuario_id: int, registros: list):
+    """Sustituye el diario de forma atómica (llamar con el lock del usuario)"""
+    ruta = _ruta_usuario(usuario_id)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        f.write("".join(_linea(r) for r in registros))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(ruta + ".tmp", ruta)
+    if os.path.exists(_ruta_indice(usuario_id)):
+        os.remove(_ruta_indice(usuario_id))  # Offsets viejos: se reconstruye al paginar
+
+def _extender_indice(usuario_id: int, inicio: int, lineas: list):
+    """
+    Añade al índice las líneas recién escritas en `inicio` (llamar con el lock del usuario).
+    Si el índice no existe o no llega hasta `inicio`, no se toca: _indice lo rehace al leer.
+    """
+    ruta_idx = _ruta_indice(usuario_id)
+    try:
+        with open(ruta_idx, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            tamaño = f.tell()
+            if tamaño < 8 or tamaño % 8:
+                return
+            f.seek(tamaño - 8)
+            if array("Q", f.read(8))[0] != inicio:
+                return
+            offsets = array("Q")
+            for linea in lineas:
+                offsets.append(inicio)
+                inicio += len(linea)
+            offsets.append(inicio)
+            f.seek(tamaño - 8)
+            offsets.tofile(f)
+    except FileNotFoundError:
+        pass
+
+def _indice(usuario_id: int) -> int:
+    """
+    Pone al día el índice de offsets (llamar con el lock del usuario) y devuelve cuántas líneas tiene.
+    Solo recorre lo que falte por indexar; si no cuadra con el diario, lo reconstruye entero.
+    """
+    ruta = _ruta_usuario(usuario_id)
+    ruta_idx = _ruta_indice(usuario_id)
+    tamaño = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+    cubierto = entradas = 0
+    if os.path.exists(ruta_idx) and os.path.getsize(ruta_idx) % 8 == 0:
+        entradas = os.path.getsize(ruta_idx) // 8
+        if entradas:
+            with open(ruta_idx, "rb") as f:
+                f.seek((entradas - 1) * 8)
+                cubierto = array("Q", f.read(8))[0]
+    if entradas and cubierto == tamaño:
+        return entradas - 1
+    if cubierto > tamaño:
+        entradas = cubierto = 0  # Diario sustituido por otro: se empieza de cero
+
+    # Offsets de las líneas completas desde `cubierto`; una línea a medias espera al siguiente volcado
+    offsets = array("Q")
+    posicion = cubierto
+    if tamaño:
+        with open(ruta, "rb") as f:
+            f.seek(cubierto)
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break
+                offsets.append(posicion)
+                posicion += len(linea)
+    offsets.append(posicion)
+
+    if entradas:
+        with open(ruta_idx, "r+b") as f:
+            f.seek((entradas - 1) * 8)
+            offsets.tofile(f)
+    else:
+        with open(ruta_idx + ".tmp", "wb") as f:
+            offsets.tofile(f)
+        os.replace(ruta_idx + ".tmp", ruta_idx)
+    return max(entradas - 1, 0) + len(offsets) - 1
+
+def _leer_lineas(usuario_id: int, inicio: int, fin: int) -> list:
+    """Registros de las líneas [inicio, fin) usando el índice (llamar tras _indice, con el lock)"""
+    if fin <= inicio:
+        return []
+    offsets = array("Q")
+    with open(_ruta_indice(usuario_id), "rb") as f:
+        f.seek(inicio * 8)
+        offsets.frombytes(f.read((fin - inicio + 1) * 8))
+    ruta = _ruta_usuario(usuario_id)
+    with open(ruta, "rb") as f:
+        f.seek(offsets[0])
+        datos = f.read(offsets[-1] - offsets[0])
+    registros = []
+    for linea in datos.splitlines():
+        try:
+            registros.append(json.loads(linea))
+        except ValueError:
+            logger.warning(f"[historial] Línea corrupta ignorada en {ruta}")
+    return registros
+
+def _rollups_vacios() -> dict:
+    return {"total": 0, "tipos": {}, "dias": {}, "usuarios": {}}
+
+def _sumar(rollups: dict, usuario_id, tipo: str, fecha: str, n: int = 1):
+    """Suma n registros a los contadores (llamar con _rollups_lock)"""
+    rollups["total"] += n
+    rollups["tipos"][tipo] = rollups["tipos"].get(tipo, 0) + n
+    dias = rollups["dias"]
+    dia = fecha[:10]
+    if dia not in dias and len(dias) >= DIAS_ROLLUP:
+        viejo = min(dias)
+        if viejo > dia:
+            dia = None  # Fuera de la ventana
+        else:
+            del dias[viejo]
+    if dia:
+        dias[dia] = dias.get(dia, 0) + n
+    usuario = rollups["usuarios"].setdefault(str(usuario_id), {"total": 0, "tipos": {}, "ultima": ""})
+    usuario["total"] += n
+    usuario["tipos"][tipo] = usuario["tipos"].get(tipo, 0) + n
+    usuario["ultima"] = max(usuario["ultima"], fecha)
+
+def _reconstruir_rollups() -> dict:
+    """Recalcula los contadores desde lo guardado (primera vez o _rollups.json ilegible)"""
+    rollups = _rollups_vacios()
+    if _db:
+        for usuario_id, tipo, fecha, n in _db.resumen():
+            _sumar(rollups, usuario_id, tipo, fecha, n)
+        return rollups
+    for nombre in os.listdir(HISTORIAL_PATH):
+        if nombre.endswith(".jsonl"):
+            usuario_id = nombre[:-len(".jsonl")]
+            for r in _leer(usuario_id):
+                _sumar(rollups, usuario_id, r.get("tipo", ""), r.get("fecha", ""))
+    return rollups
+
+def _cargar_rollups() -> dict:
+    global _rollups, _rollups_sucio
+    if _rollups is None:
+        with _rollups_lock:
+            if _rollups is None:
+                guardados = persistencia.cargar_json(ROLLUPS_PATH)
+                if guardados is not None:
+                    _rollups = {**_rollups_vacios(), **guardados}
+                else:
+                    _rollups = _reconstruir_rollups()
+                    _rollups_sucio = True
+                    logger.info(f"[historial] Contadores reconstruidos: {_rollups['total']} registros, "
+                                f"{len(_rollups['usuarios'])} usuarios")
+    return _rollups
+
+def _persistir_rollups():
+    """Guarda los contadores si cambiaron desde el último volcado"""
+    global _rollups_sucio
+    with _rollups_lock:
+        if not _rollups_sucio:
+            return
+        datos = json.dumps(_rollups, ensure_ascii=False, separators=(",", ":"))
+        _rollups_sucio = False
+    persistencia.escribir_atomico(ROLLUPS_PATH, datos)
+
+def _volcar_lote():
+    """Escribe todo lo pendiente: un write (o una transacción) por usuario, y los contadores"""
+    with _volcado_lock:
+        with _cond:
+            lote = list(_pendientes)
+            _pendientes.clear()
+            _cond.notify_all()  # Hay sitio otra vez para los productores
+        por_usuario = {}
+        for usuario_id, registro in lote:
+            por_usuario.setdefault(usuario_id, []).append(registro)
+        if _db and por_usuario:
+            try:
+                _db.anexar_lote(por_usuario)
+            except Exception as e:
+                logger.error(f"[historial] No se pudo guardar un lote de {len(lote)} registros: {e}")
+        elif por_usuario:
+            for usuario_id, registros in por_usuario.items():
+                try:
+                    _anexar(usuario_id, registros)
+                except Exception as e:
+                    logger.error(f"[historial] No se pudieron guardar {len(registros)} registros de {usuario_id}: {e}")
+        if _busqueda and por_usuario:
+            try:
+                _busqueda.indexar(por_usuario)
+            except Exception as e:
+                logger.error(f"[historial] No se pudo indexar un lote para búsqueda: {e}")
+        try:
+            _persistir_rollups()
+        except OSError as e:
+            logger.error(f"[historial] No se pudieron guardar los contadores: {e}")
+        return len(lote)
+
+def _bucle_volcador():
+    while True:
+        with _cond:
+            _cond.wait_for(lambda: len(_pendientes) >= min(LOTE, MAX_PENDIENTES), timeout=FLUSH_CADA)
+        _volcar_lote()
+
+def _asegurar_volcador():
+    global _volcador
+    if _volcador is None:
+        with _cond:
+            if _volcador is None:
+                _volcador = threading.Thread(target=_bucle_volcador, name="historial_volcador", daemon=True)
+                _volcador.start()
+
+@atexit.register
+def vaciar():
+    """Escribe ya los registros pendientes (lecturas, cierre del bot)"""
+    _volcar_lote()
 
 def registrar(usuario_id: int, nombre_archivo: str, tipo: str, url: str = "", duracion: str = ""):
     """
     Registra una descarga en el historial del usuario.
+    No toca el disco: el registro queda en un buffer acotado y un hilo lo vuelca en lotes
+    (group commit), en orden por usuario. Las lecturas vacían el buffer antes.
     """
     registro = {
         "nombre": nombre_archivo,
@@ -28,36 +439,34 @@ def registrar(usuario_id: int, nombre_archivo: str, tipo: str, url: str = "", du
         "duracion": duracion,
         "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
-
-    ruta = _ruta_usuario(usuario_id)
-    historial = []
-
-    # Cargar historial existente
-    if os.path.exists(ruta):
-        with open(ruta, "r", encoding="utf-8") as f:
-            try:
-                historial = json.load(f)
-            except:
-                historial = []
-
-    # Añadir nuevo registro
-    historial.append(registro)
-
-    # Guardar nuevamente
-    with open(ruta, "w", encoding="utf-8") as f:
-        json.dump(historial, f, ensure_ascii=False, indent=4)
+    global _rollups_sucio
+    _migrar()
+    rollups = _cargar_rollups()
+    _asegurar_volcador()
+    with _rollups_lock:
+        _sumar(rollups, usuario_id, tipo, registro["fecha"])
+        _rollups_sucio = True
+    with _recientes_lock:
+        # Solo se actualizan usuarios ya en caché; el resto se carga al leerlos
+        entrada = _recientes.get(str(usuario_id))
+        if entrada:
+            entrada[0].append(registro)
+        with _cond:
+            _cond.wait_for(lambda: len(_pendientes) < MAX_PENDIENTES)
+            _pendientes.append((usuario_id, registro))
+            if len(_pendientes) >= min(LOTE, MAX_PENDIENTES):
+                _cond.notify_all()
 
 def obtener(usuario_id: int, tipo: str = None):
     """
     Obtiene historial completo del usuario.
     Si tipo se especifica, filtra por tipo de archivo (videos, fotos, mangas, etc.)
     """
-    ruta = _ruta_usuario(usuario_id)
-    if not os.path.exists(ruta):
-        return []
-
-    with open(ruta, "r", encoding="utf-8") as f:
-        historial = json.load(f)
+    _migrar()
+    vaciar()
+    if _db:
+        return _db.obtener(usuario_id, tipo)  # Filtro por el índice (usuario_id, tipo)
+    historial = _leer(usuario_id)
 
     if tipo:
         historial = [h for h in historial if h["tipo"] == tipo]
@@ -68,30 +477,219 @@ def limpiar(usuario_id: int):
     """
     Limpia todo el historial de un usuario.
     """
+    global _rollups_sucio
+    _migrar()
+    vaciar()
+    with _recientes_lock:
+        _recientes.pop(str(usuario_id), None)
+    rollups = _cargar_rollups()
+    with _rollups_lock:
+        if rollups["usuarios"].pop(str(usuario_id), None):
+            _rollups_sucio = True
+    if _busqueda:
+        _busqueda.borrar(usuario_id)
+    if _db:
+        return _db.limpiar(usuario_id)
     ruta = _ruta_usuario(usuario_id)
-    if os.path.exists(ruta):
-        os.remove(ruta)
-        return True
+    with _lock_usuario(usuario_id):
+        if os.path.exists(_ruta_indice(usuario_id)):
+            os.remove(_ruta_indice(usuario_id))
+        if os.path.exists(ruta):
+            os.remove(ruta)
+            return True
     return False
 
 def ultimo(usuario_id: int, n: int = 5):
     """
     Obtiene los últimos n registros del usuario.
+    Usuarios activos: desde la caché en memoria. Si no, lee solo la cola del diario (o de la tabla).
     """
-    historial_usuario = obtener(usuario_id)
-    return historial_usuario[-n:] if historial_usuario else []
+    clave = str(usuario_id)
+    _migrar()
+    with _recientes_lock:
+        entrada = _recientes.get(clave)
+        if entrada and (len(entrada[0]) >= n or (entrada[1] and len(entrada[0]) < CACHE_REGISTROS)):
+            _recientes.move_to_end(clave)
+            return list(entrada[0])[-n:] if n > 0 else []
+
+        # Con el lock tomado ningún registrar se cuela entre el volcado y la lectura
+        vaciar()
+        cargar = max(n, CACHE_REGISTROS)
+        registros = _db.ultimo(usuario_id, cargar) if _db else _leer_cola(usuario_id, cargar)
+        _recientes[clave] = (deque(registros, maxlen=CACHE_REGISTROS), len(registros) < cargar)
+        _recientes.move_to_end(clave)
+        while len(_recientes) > CACHE_USUARIOS:
+            _recientes.popitem(last=False)
+    return registros[-n:] if n > 0 else []
+
+def _cortes_retencion() -> dict:
+    """tipo -> (fecha mínima como texto o None, máximo de registros o 0)"""
+    ahora = datetime.now()
+    return {
+        tipo: ((ahora - timedelta(days=dias)).strftime("%Y-%m-%d %H:%M:%S") if dias else None, maximo)
+        for tipo, (dias, maximo) in RETENCION.items()
+    }
+
+def _retener(registros: list, cortes: dict) -> list:
+    """Registros (en orden cronológico) que sobreviven a la retención, en el mismo orden"""
+    por_tipo = {}
+    conservados = []
+    for r in reversed(registros):  # Del más reciente al más viejo
+        tipo = r.get("tipo")
+        if tipo in cortes:
+            fecha_minima, maximo = cortes[tipo]
+            if fecha_minima and r.get("fecha", "") < fecha_minima:
+                continue
+            por_tipo[tipo] = por_tipo.get(tipo, 0) + 1
+            if maximo and por_tipo[tipo] > maximo:
+                continue
+        conservados.append(r)
+        if len(conservados) >= MAX_REGISTROS_USUARIO:
+            break
+    conservados.reverse()
+    return conservados
+
+def _olvidar_retenidos(usuario_id, registros: list = None):
+    """Tras recortar el historial de un usuario: fuera de la caché y reindexado para búsqueda"""
+    with _recientes_lock:
+        _recientes.pop(str(usuario_id), None)
+    if _busqueda:
+        _busqueda.borrar(usuario_id)
+        _busqueda.indexar({usuario_id: registros if registros is not None else obtener(usuario_id)})
+
+def compactar(usuario_id: int = None) -> int:
+    """
+    Compactación offline: aplica la retención y reescribe el diario en JSONL compacto,
+    sin líneas corruptas. Solo se reescriben los diarios que cambian.
+    Sin usuario_id, compacta todos. Devuelve cuántos historiales se recortaron o reescribieron.
+    Los contadores de estadisticas() no cambian: cuentan descargas hechas.
+    La retención es RETENCION por tipo y MAX_REGISTROS_USUARIO; mantenimiento la lanza a diario.
+    """
+    _migrar()
+    vaciar()
+    cortes = _cortes_retencion()
+    if _db:
+        afectados = _db.aplicar_retencion(cortes, MAX_REGISTROS_USUARIO, usuario_id)
+        for uid in afectados:
+            _olvidar_retenidos(uid)
+        _db.compactar()
+        if afectados:
+            logger.info(f"[historial] Retención aplicada en SQLite: {len(afectados)} usuarios recortados")
+        return len(afectados)
+
+    if usuario_id is None:
+        usuarios = [n[:-len(".jsonl")] for n in os.listdir(HISTORIAL_PATH) if n.endswith(".jsonl")]
+    else:
+        usuarios = [usuario_id]
+    reescritos = 0
+    for uid in usuarios:
+        with _lock_usuario(uid):
+            registros = _leer(uid)
+            conservados = _retener(registros, cortes)
+            # Menos registros que líneas = había líneas corruptas
+            if len(conservados) == len(registros) == _indice(uid):
+                continue
+            _reescribir(uid, conservados)
+        if len(conservados) != len(registros):
+            _olvidar_retenidos(uid, conservados)
+        reescritos += 1
+    if reescritos:
+        logger.info(f"[historial] Compactación: {reescritos} de {len(usuarios)} diarios reescritos")
+    return reescritos
+
+def estadisticas(usuario_id: int = None, dias: int = 7) -> dict:
+    """
+    Contadores agregados sin leer ningún diario: registrar los mantiene al día
+    y se guardan en _rollups.json con cada volcado.
+    Sin usuario_id: total, usuarios con historial, por tipo y descargas de los últimos `dias` días.
+    Con usuario_id: total, por tipo y fecha de la última descarga de ese usuario.
+    """
+    _migrar()
+    rollups = _cargar_rollups()
+    with _rollups_lock:
+        if usuario_id is not None:
+            usuario = rollups["usuarios"].get(str(usuario_id), {"total": 0, "tipos": {}, "ultima": ""})
+            return {"total": usuario["total"], "tipos": dict(usuario["tipos"]), "ultima": usuario["ultima"]}
+        hoy = datetime.now().date()
+        ultimos = [(d, rollups["dias"].get(d, 0))
+                   for d in ((hoy - timedelta(days=i)).isoformat() for i in range(dias))]
+        return {
+            "total": rollups["total"],
+            "usuarios": len(rollups["usuarios"]),
+            "tipos": dict(rollups["tipos"]),
+            "hoy": ultimos[0][1],
+            "dias": ultimos,
+        }
+
+def obtener_pagina(usuario_id: int, numero: int = 0, por_pagina: int = POR_PAGINA, tipo: str = None):
+    """
+    Página `numero` del historial contando desde lo más reciente (0 = últimos `por_pagina`).
+    Devuelve (registros en orden cronológico, total de registros).
+    Sin filtro de tipo, en JSONL solo se leen del disco las líneas de la página
+    gracias al índice de offsets que acompaña a cada diario (<usuario_id>.idx).
+    """
+    _migrar()
+    vaciar()
+    if _db:
+        return _db.pagina(usuario_id, numero * por_pagina, por_pagina, tipo), _db.contar(usuario_id, tipo)
+    if tipo:
+        registros = obtener(usuario_id, tipo)
+        total = len(registros)
+        fin = max(total - numero * por_pagina, 0)
+        return registros[max(fin - por_pagina, 0):fin], total
+    with _lock_usuario(usuario_id):
+        total = _indice(usuario_id)
+        fin = max(total - numero * por_pagina, 0)
+        return _leer_lineas(usuario_id, max(fin - por_pagina, 0), fin), total
+
+def buscar(usuario_id: int, texto: str, limite: int = 10) -> list:
+    """
+    Registros del usuario cuyo nombre o URL contienen todas las palabras de `texto`
+    (también como prefijo), del más relevante al menos.
+    Usa el índice de texto completo (modulos/historial_busqueda, .busqueda.db) que se alimenta
+    en cada volcado; sin FTS5, recorre el historial del usuario.
+    """
+    _migrar()
+    vaciar()
+    if _busqueda:
+        return _busqueda.buscar(usuario_id, texto, limite)
+    palabras = texto.lower().split()
+    if not palabras:
+        return []
+    encontrados = [r for r in reversed(obtener(usuario_id))
+                   if all(p in f"{r['nombre'] or ''} {r['url'] or ''}".lower() for p in palabras)]
+    return encontrados[:limite]
+
+TIPO_EMOJI = {
+    "videos": "🎬", "audio": "🎵", "fotos": "📷", "mangas": "📚", "qr": "🔍",
+    "ocr": "📝", "objetos": "👁️", "metadata": "🌍"
+}
 
-def mostrar(usuario_id: int, tipo: str = None):
+def mostrar(usuario_id: int, tipo: str = None, numero: int = 0):
     """
-    Retorna un texto listo para enviar al chat con el historial del usuario.
+    Retorna (texto listo para enviar al chat, número de páginas) con una página del historial.
+    El texto nunca pasa de config.MAX_MESSAGE_LENGTH.
     """
-    registros = obtener(usuario_id, tipo)
+    registros, total = obtener_pagina(usuario_id, numero, tipo=tipo)
+    paginas = (total + POR_PAGINA - 1) // POR_PAGINA
+    if not registros and paginas and numero >= paginas:
+        numero = paginas - 1
+        registros, total = obtener_pagina(usuario_id, numero, tipo=tipo)
     if not registros:
-        return "No tienes historial registrado."
+        return "No tienes historial registrado.", 0
 
-    texto = f"📜 Historial de descargas (Usuario {usuario_id}):\n\n"
-    for i, r in enumerate(registros, 1):
-        texto += f"{i}. {r['tipo'].capitalize()}: {r['nombre']}\n   URL: {r['url']}\n   Fecha: {r['fecha']}\n"
+    texto = f"📜 Historial de descargas — página {numero + 1}/{paginas} ({total} registros):\n\n"
+    posicion = max(total - numero * POR_PAGINA, 0)
+    for r in reversed(registros):  # Lo más reciente primero
+        bloque = (f"{posicion}. {TIPO_EMOJI.get(r['tipo'], '📄')} {(r['tipo'] or '').capitalize()}: {(r['nombre'] or '')[:80]}\n"
+                  f"   📅 {r['fecha']}\n")
         if r.get("duracion"):
-            texto += f"   Duración: {r['duracion']}\n"
-    return texto
\ No newline at end of file
+            bloque += f"   ⏱️ {r['duracion']}\n"
+        if r.get("url"):
+            bloque += f"   🔗 {r['url'][:100]}\n"
+        if len(texto) + len(bloque) + 1 > config.MAX_MESSAGE_LENGTH:
+            texto += "…"
+            break
+        texto += bloque
+        posicion -= 1
+    return texto, paginas
@@ -0,0 +1,98 @@
+"""
+historial_busqueda.py
+Índice de texto completo del historial (SQLite FTS5) sobre el nombre y la URL de cada registro.
+Es un archivo aparte (downloads/historial/.busqueda.db) que sirve igual con diarios JSONL
+que con el backend SQLite: historial.py lo alimenta en cada volcado y lo consulta en buscar().
+"""
+
+import os
+import re
+import sqlite3
+import logging
+import threading
+from modulos import persistencia
+
+logger = logging.getLogger(__name__)
+
+RUTA_DB = None
+_local = threading.local()  # Una conexión por hilo (sqlite3 no se comparte entre hilos)
+
+# usuario va como columna indexada para filtrar dentro del propio MATCH
+ESQUEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS busqueda USING fts5(
+    nombre, url, usuario, tipo UNINDEXED, duracion UNINDEXED, fecha UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS estado (clave TEXT PRIMARY KEY, valor TEXT);
+"""
+COLUMNAS = ("nombre", "tipo", "url", "duracion", "fecha")
+
+def configurar(ruta: str) -> bool:
+    """Abre (o crea) el índice; False si este SQLite no trae FTS5"""
+    global RUTA_DB
+    if os.path.dirname(ruta):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    RUTA_DB = ruta
+    try:
+        _conexion()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"[historial_busqueda] Búsqueda indexada no disponible: {e}")
+        RUTA_DB = None
+        return False
+    return True
+
+def _conexion() -> sqlite3.Connection:
+    return persistencia.conexion_por_hilo(_local, RUTA_DB, ESQUEMA)
+
+def construido() -> bool:
+    """True si ya se indexó el historial existente (solo hace falta una vez)"""
+    return _conexion().execute("SELECT 1 FROM estado WHERE clave = 'construido'").fetchone() is not None
+
+def construir(registros_por_usuario):
+    """Indexa el historial existente; `registros_por_usuario` da pares (usuario_id, registros)"""
+    conexion = _conexion()
+    total = 0
+    with conexion:
+        conexion.execute("DELETE FROM busqueda")
+        for usuario_id, registros in registros_por_usuario:
+            _insertar(conexion, {usuario_id: registros})
+            total += len(registros)
+        conexion.execute("INSERT OR REPLACE INTO estado (clave, valor) VALUES ('construido', '1')")
+    logger.info(f"[historial_busqueda] Índice construido: {total} registros")
+
+def _insertar(conexion, por_usuario: dict):
+    conexion.executemany(
+        "INSERT INTO busqueda (nombre, url, usuario, tipo, duracion, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+        [(str(r.get("nombre") or ""), str(r.get("url") or ""), str(usuario_id),
+          r.get("tipo"), r.get("duracion"), r.get("fecha"))
+         for usuario_id, registros in por_usuario.items() for r in registros]
+    )
+
+def indexar(por_usuario: dict):
+    """Añade un lote de registros {usuario_id: [registros]} en una transacción"""
+    conexion = _conexion()
+    with conexion:
+        _insertar(conexion, por_usuario)
+
+def borrar(usuario_id: int):
+    conexion = _conexion()
+    with conexion:
+        conexion.execute("DELETE FROM busqueda WHERE usuario MATCH ?", (f'"{int(usuario_id)}"',))
+
+def _consulta(texto: str) -> str:
+    """Términos del usuario -> expresión FTS5 segura: todas las palabras, por prefijo, en nombre o URL"""
+    palabras = re.findall(r"\w+", texto.lower())
+    if not palabras:
+        return ""
+    return "{nombre url} : (" + " ".join(f'"{p}"*' for p in palabras) + ")"
+
+def buscar(usuario_id: int, texto: str, limite: int = 10) -> list:
+    """Mejores coincidencias (bm25) del usuario, de la más relevante a la menos"""
+    consulta = _consulta(texto)
+    if not consulta:
+        return []
+    filas = _conexion().execute(
+        "SELECT * FROM busqueda WHERE busqueda MATCH ? ORDER BY rank LIMIT ?",
+        (f'usuario : "{int(usuario_id)}" AND {consulta}', limite)
+    )
+    return [{c: f[c] for c in COLUMNAS} for f in filas]
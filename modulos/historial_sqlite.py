@@ -0,0 +1,176 @@
+"""
+historial_sqlite.py
+Backend SQLite opcional del historial (config.USE_DATABASE con DATABASE_URL=sqlite:///ruta.db).
+Modo WAL (lectores no bloquean al escritor) e índices por (usuario_id, fecha) y
+(usuario_id, tipo): las consultas por usuario no dependen del tamaño del historial.
+historial.py delega aquí con la misma API cuando está activo.
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+from modulos import persistencia
+
+logger = logging.getLogger(__name__)
+
+RUTA_DB = None
+_local = threading.local()  # Una conexión por hilo (sqlite3 no se comparte entre hilos)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS historial (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    usuario_id INTEGER NOT NULL,
+    nombre TEXT,
+    tipo TEXT,
+    url TEXT,
+    duracion NUMERIC,
+    fecha TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_historial_usuario_fecha ON historial (usuario_id, fecha);
+CREATE INDEX IF NOT EXISTS idx_historial_usuario_tipo ON historial (usuario_id, tipo);
+"""
+COLUMNAS = ("nombre", "tipo", "url", "duracion", "fecha")
+NUMERICAS = ("duracion",)  # Segundos como número; "" (sin duración) se guarda como NULL
+
+def configurar(database_url: str) -> bool:
+    """Activa el backend si la URL es de SQLite; con otro motor devuelve False"""
+    global RUTA_DB
+    if not database_url:
+        return False
+    if database_url.startswith("sqlite:///"):
+        ruta = database_url[len("sqlite:///"):]
+    elif "://" not in database_url:
+        ruta = database_url
+    else:
+        logger.warning(f"[historial_sqlite] DATABASE_URL no es SQLite, se sigue con JSONL: {database_url.split('://')[0]}")
+        return False
+    if os.path.dirname(ruta):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    RUTA_DB = ruta
+    _conexion()
+    logger.info(f"[historial_sqlite] Historial en SQLite: {RUTA_DB}")
+    return True
+
+def _conexion() -> sqlite3.Connection:
+    return persistencia.conexion_por_hilo(_local, RUTA_DB, ESQUEMA)
+
+def _valor(registro: dict, columna: str):
+    """None -> NULL; texto en las columnas de texto; números tal cual en las numéricas"""
+    valor = registro.get(columna)
+    if valor is None or (columna in NUMERICAS and valor == ""):
+        return None
+    if columna in NUMERICAS:
+        return valor if isinstance(valor, (int, float)) else str(valor)  # "42" -> 42 por afinidad
+    return str(valor)
+
+def _registro(fila) -> dict:
+    return {c: fila[c] for c in COLUMNAS}
+
+def anexar(usuario_id: int, registros: list):
+    """Inserta registros en una sola transacción"""
+    anexar_lote({usuario_id: registros})
+
+def anexar_lote(por_usuario: dict):
+    """Group commit: los registros de varios usuarios en una única transacción"""
+    conexion = _conexion()
+    with conexion:
+        conexion.executemany(
+            "INSERT INTO historial (usuario_id, nombre, tipo, url, duracion, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+            [(int(usuario_id), *(_valor(r, c) for c in COLUMNAS))
+             for usuario_id, registros in por_usuario.items() for r in registros]
+        )
+
+def obtener(usuario_id: int, tipo: str = None) -> list:
+    if tipo:
+        filas = _conexion().execute(
+            "SELECT * FROM historial WHERE usuario_id = ? AND tipo = ? ORDER BY fecha, id",
+            (int(usuario_id), tipo)
+        )
+    else:
+        filas = _conexion().execute(
+            "SELECT * FROM historial WHERE usuario_id = ? ORDER BY fecha, id", (int(usuario_id),)
+        )
+    return [_registro(f) for f in filas]
+
+def ultimo(usuario_id: int, n: int = 5) -> list:
+    """Últimos n en orden cronológico; recorre el índice desde el final"""
+    filas = _conexion().execute(
+        "SELECT * FROM historial WHERE usuario_id = ? ORDER BY fecha DESC, id DESC LIMIT ?",
+        (int(usuario_id), n)
+    ).fetchall()
+    return [_registro(f) for f in reversed(filas)]
+
+def pagina(usuario_id: int, desplazamiento: int, limite: int, tipo: str = None) -> list:
+    """`limite` registros saltando los `desplazamiento` más recientes, en orden cronológico"""
+    filtro, parametros = ("AND tipo = ?", (int(usuario_id), tipo)) if tipo else ("", (int(usuario_id),))
+    filas = _conexion().execute(
+        f"SELECT * FROM historial WHERE usuario_id = ? {filtro} ORDER BY fecha DESC, id DESC LIMIT ? OFFSET ?",
+        (*parametros, limite, desplazamiento)
+    ).fetchall()
+    return [_registro(f) for f in reversed(filas)]
+
+def contar(usuario_id: int, tipo: str = None) -> int:
+    if tipo:
+        fila = _conexion().execute(
+            "SELECT COUNT(*) FROM historial WHERE usuario_id = ? AND tipo = ?", (int(usuario_id), tipo)
+        ).fetchone()
+    else:
+        fila = _conexion().execute("SELECT COUNT(*) FROM historial WHERE usuario_id = ?", (int(usuario_id),)).fetchone()
+    return fila[0]
+
+def usuarios() -> list:
+    return [f[0] for f in _conexion().execute("SELECT DISTINCT usuario_id FROM historial")]
+
+def resumen() -> list:
+    """(usuario_id, tipo, última fecha del día, registros) por usuario, tipo y día, en una consulta"""
+    return _conexion().execute(
+        "SELECT usuario_id, tipo, MAX(fecha), COUNT(*) FROM historial "
+        "GROUP BY usuario_id, tipo, substr(fecha, 1, 10)"
+    ).fetchall()
+
+def limpiar(usuario_id: int) -> bool:
+    conexion = _conexion()
+    with conexion:
+        cursor = conexion.execute("DELETE FROM historial WHERE usuario_id = ?", (int(usuario_id),))
+    return cursor.rowcount > 0
+
+def vacia() -> bool:
+    return _conexion().execute("SELECT 1 FROM historial LIMIT 1").fetchone() is None
+
+def aplicar_retencion(cortes: dict, max_por_usuario: int, usuario_id: int = None) -> set:
+    """
+    Borra lo que no cumple la retención. `cortes`: tipo -> (fecha mínima o None, máximo por usuario o 0).
+    Devuelve los usuario_id que perdieron registros.
+    """
+    filtro, parametros = ("AND usuario_id = ?", (int(usuario_id),)) if usuario_id is not None else ("", ())
+    conexion = _conexion()
+    sobrantes = []
+    for tipo, (fecha_minima, maximo) in cortes.items():
+        if fecha_minima:
+            sobrantes += conexion.execute(
+                f"SELECT id, usuario_id FROM historial WHERE tipo = ? AND fecha < ? {filtro}",
+                (tipo, fecha_minima, *parametros)
+            ).fetchall()
+        if maximo:
+            sobrantes += conexion.execute(
+                "SELECT id, usuario_id FROM (SELECT id, usuario_id, ROW_NUMBER() OVER "
+                "(PARTITION BY usuario_id ORDER BY fecha DESC, id DESC) AS n "
+                f"FROM historial WHERE tipo = ? {filtro}) WHERE n > ?",
+                (tipo, *parametros, maximo)
+            ).fetchall()
+    if max_por_usuario:
+        sobrantes += conexion.execute(
+            "SELECT id, usuario_id FROM (SELECT id, usuario_id, ROW_NUMBER() OVER "
+            "(PARTITION BY usuario_id ORDER BY fecha DESC, id DESC) AS n "
+            f"FROM historial WHERE 1 {filtro}) WHERE n > ?",
+            (*parametros, max_por_usuario)
+        ).fetchall()
+    if sobrantes:
+        with conexion:
+            conexion.executemany("DELETE FROM historial WHERE id = ?", [(f[0],) for f in sobrantes])
+    return {f[1] for f in sobrantes}
+
+def compactar():
+    """Vuelca el WAL a la base y lo trunca"""
+    _conexion().execute("PRAGMA wal_checkpoint(TRUNCATE)")
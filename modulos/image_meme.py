@@ -5,7 +5,7 @@ import io
 from PIL import Image
 from telegram import Update
 from telegram.ext import ContextTypes
-from modulos import historial, interprete
+from modulos import historial, interprete, file_ids
 
 # Carpetas para stickers
 STICKERS_PATH = "downloads/stickers"
@@ -38,7 +38,7 @@ async def meme(update: Update, context: ContextTypes.DEFAULT_TYPE):
     sticker_path, whatsapp_path = generar_sticker(file_bytes, update.message.from_user.id)
 
     # Responder en Telegram
-    await update.message.reply_sticker(sticker_path)
+    await file_ids.enviar(update.message, "sticker", sticker_path)
     await update.message.reply_text(f"Sticker listo para WhatsApp: {whatsapp_path}")
 
 def generar_sticker(file_bytes: io.BytesIO, user_id: int):
@@ -10,33 +10,49 @@ import asyncio
 import aiofiles
 import cv2
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
-from telegram import Update, InputFile
+from datetime import datetime
+from telegram import Update, Message, Chat, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from modulos import (
-    downloader, sex,storage_manager, historial, resource_manager)
+    downloader, sex,storage_manager, historial, resource_manager, download_queue, media_cache,
+    file_ids, postproceso, derivados, mantenimiento, analisis_cache, persistencia)
 import time
-from functools import lru_cache
-import hashlib
-import subprocess
+from functools import wraps
 
 # Configuración de performance
 MAX_WORKERS = 8  # Núcleos para procesamiento paralelo
-CACHE_SIZE = 1000  # Máximo de resultados cacheados
 TIMEOUT_ANALISIS = 30  # Segundos máximo por análisis
 
 # Carpeta para imágenes temporales con limpieza automática
 CARPETA_IMAGENES = "imagenes_temp"
 os.makedirs(CARPETA_IMAGENES, exist_ok=True)
 
+# Descargas en curso: se persisten para retomarlas si el bot se reinicia a mitad
+PENDIENTES_PATH = "downloads/.descargas_pendientes.json"
+MAX_REANUDACIONES = 3            # Reinicios tras los que una descarga pendiente se abandona
+MAX_EDAD_PENDIENTE = 24 * 3600   # Segundos tras los que tampoco se reanuda
+
 # Executors para procesamiento paralelo
 thread_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 process_executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
 
-# Cache de resultados de análisis
-@lru_cache(maxsize=CACHE_SIZE)
-def cache_analisis_imagen(image_hash: str, modulo: str):
-    """Cache de resultados para imágenes repetidas"""
-    return None
+# Cache de resultados de análisis (persistente, por contenido: modulos/analisis_cache)
+def _cacheable(resultado) -> bool:
+    """Solo resultados reales: ni vacíos, ni errores, ni marcadores de análisis sin implementar"""
+    if not resultado or resultado == "None":
+        return False
+    texto = str(resultado)
+    return not (texto.startswith(("Error", "Timeout")) or "Error:" in texto or "no implementad" in texto)
+
+def con_cache(funcion):
+    """Guarda en analisis_cache el resultado del analizador cuando termina sin error"""
+    @wraps(funcion)
+    def envoltura(ruta_imagen, usuario_id, image_hash, nombre):
+        resultado = funcion(ruta_imagen, usuario_id, image_hash, nombre)
+        if _cacheable(resultado):
+            analisis_cache.guardar(image_hash, nombre, resultado)
+        return resultado
+    return envoltura
 
 async def interpretar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Router principal ultra-rápido con timeouts y fallbacks"""
@@ -97,10 +113,9 @@ async def procesar_texto_rapido(mensaje, usuario_id: int):
     url_match = re.search(r'https?://[^\s<>"]+|www\.[^\s<>"]+', texto)
     if url_match:
         url = url_match.group(0)
-        await mensaje.reply_text(f"⚡ Descargando: {url[:50]}...")
-        
-        # Procesamiento en segundo plano sin bloquear
-        asyncio.create_task(procesar_descarga_url(url, usuario_id, mensaje))
+
+        # Procesamiento en segundo plano sin bloquear (avisa al encolar: ya se sabe la posición)
+        asyncio.create_task(procesar_descarga_url(url, usuario_id, mensaje, avisar=True))
         return
     
     # Comandos rápidos pre-cacheados
@@ -120,17 +135,27 @@ async def procesar_texto_rapido(mensaje, usuario_id: int):
 
 async def procesar_imagen_ultrarrápido(mensaje, usuario_id: int, context):
     """Procesamiento paralelo masivo de imágenes"""
-    # Descarga ultra-rápida en segundo plano
     foto = mensaje.photo[-1]
+
+    # Reenvíos y reposts conservan el file_unique_id: si ese contenido ya se analizó, ni se descarga
+    image_hash = analisis_cache.digest_de(foto.file_unique_id)
+    if image_hash:
+        resultados = await ejecutar_analisis_paralelo(None, usuario_id, image_hash, solo_cache=True)
+        if resultados is not None:
+            await enviar_resultados_optimizados(mensaje, resultados, os.path.join(CARPETA_IMAGENES, image_hash))
+            return
+
+    # Descarga ultra-rápida en segundo plano
     file = await foto.get_file()
-    
-    # Hash único para caching
-    image_hash = hashlib.md5(f"{usuario_id}_{mensaje.message_id}".encode()).hexdigest()
-    ruta_local = os.path.join(CARPETA_IMAGENES, f"{image_hash}.jpg")
+    ruta_local = os.path.join(CARPETA_IMAGENES, f"{usuario_id}_{mensaje.message_id}.jpg")
     
     # Descarga asíncrona no bloqueante
     async with aiofiles.open(ruta_local, 'wb') as f:
         await f.write(await file.download_as_bytearray())
+
+    # Clave de caché: el contenido, no el mensaje (la misma imagen subida de nuevo también acierta)
+    image_hash = await asyncio.to_thread(file_ids.hash_contenido, ruta_local)
+    analisis_cache.recordar_digest(foto.file_unique_id, image_hash)
     
     await mensaje.reply_text("🚀 Análisis paralelo iniciado...")
     
@@ -151,11 +176,17 @@ async def procesar_imagen_ultrarrápido(mensaje, usuario_id: int, context):
         await mensaje.reply_text(f"📊 Resultados parciales:\n{resultados_parciales}")
     
     finally:
-        # Limpieza automática en segundo plano
-        asyncio.create_task(limpiar_archivo_temp(ruta_local))
-
-async def ejecutar_analisis_paralelo(ruta_imagen: str, usuario_id: int, image_hash: str) -> list:
-    """Ejecuta TODOS los análisis en paralelo como un supercomputador"""
+        # El planificador de mantenimiento la borra al caducar
+        mantenimiento.programar_borrado(ruta_local)
+
+async def ejecutar_analisis_paralelo(ruta_imagen: str, usuario_id: int, image_hash: str,
+                                     solo_cache: bool = False) -> list:
+    """
+    Ejecuta TODOS los análisis en paralelo como un supercomputador.
+    Los que ya tienen resultado para este contenido salen de analisis_cache sin ejecutarse.
+    Con solo_cache devuelve None si falta alguno (la imagen aún no está descargada).
+    Los de SIN_ARCHIVO no leen la imagen ni pasan por la caché: se ejecutan siempre.
+    """
     modulos_analisis = [
         ("QR", analizar_qr),
        # ("Texto", analizar_texto),
@@ -167,21 +198,35 @@ async def ejecutar_analisis_paralelo(ruta_imagen: str, usuario_id: int, image_ha
         ("Calidad", analizar_calidad)
     ]
     
-    # Ejecutar todos los análisis concurrentemente
+    cacheables = [(nombre, funcion) for nombre, funcion in modulos_analisis if funcion not in SIN_ARCHIVO]
+    cacheados = analisis_cache.obtener(image_hash, [nombre for nombre, _ in cacheables])
+    pendientes = [(nombre, funcion) for nombre, funcion in cacheables if nombre not in cacheados]
+    if pendientes and solo_cache:
+        return None
+
+    # Un acierto no ejecuta el analizador, pero el historial debe quedar igual que si se hubiera ejecutado
+    if "QR" in cacheados:
+        await asyncio.to_thread(registrar_qr_cacheado, usuario_id, image_hash)
+
+    # Ejecutar concurrentemente los análisis que faltan
     tasks = []
-    for nombre, funcion in modulos_analisis:
+    for nombre, funcion in pendientes:
         task = ejecutar_con_timeout(
-            funcion, ruta_imagen, usuario_id, image_hash, nombre
+            con_cache(funcion), ruta_imagen, usuario_id, image_hash, nombre
         )
         tasks.append(task)
     
     # Esperar todos los resultados con gather
-    resultados = await asyncio.gather(*tasks, return_exceptions=True)
+    resultados = dict(zip([nombre for nombre, _ in pendientes],
+                          await asyncio.gather(*tasks, return_exceptions=True)))
+    resultados.update(cacheados)
+    resultados.update({nombre: funcion(ruta_imagen, usuario_id, image_hash, nombre)
+                       for nombre, funcion in modulos_analisis if funcion in SIN_ARCHIVO})
     
     # Procesar resultados
     resultados_finales = []
-    for i, (nombre, _) in enumerate(modulos_analisis):
-        resultado = resultados[i]
+    for nombre, _ in modulos_analisis:
+        resultado = resultados[nombre]
         if isinstance(resultado, Exception):
             resultados_finales.append(f"❌ {nombre}: Error - {resultado}")
         elif resultado and resultado != "None":
@@ -202,15 +247,21 @@ async def ejecutar_con_timeout(func, *args, **kwargs):
         return f"Error: {str(e)}"
 
 # FUNCIONES DE ANÁLISOS OPTIMIZADAS (CACHE + THREADING)
-def analizar_qr(ruta_imagen: str, usuario_id: int, image_hash: str) -> str:
-    """Análisis QR optimizado con caching"""
-    cached = cache_analisis_imagen(image_hash, "qr")
-    if cached: return cached
-    
-    resultado = sex.decodificar_qr(ruta_imagen, usuario_id)
-    cache_analisis_imagen.cache_clear()  # Mantener cache fresco
+def analizar_qr(ruta_imagen: str, usuario_id: int, image_hash: str, nombre: str = "QR") -> str:
+    """Análisis QR (el caching lo hace ejecutar_analisis_paralelo)"""
+    codigos = sex.leer_codigos(ruta_imagen)
+    resultado = sex.decodificar_qr(ruta_imagen, usuario_id, codigos)
+    if codigos:
+        # Para registrarlos en historial cuando el resultado salga de la caché
+        analisis_cache.guardar_datos(image_hash, nombre, codigos)
     return str(resultado)[:200]  # Limitar tamaño
 
+def registrar_qr_cacheado(usuario_id: int, image_hash: str):
+    """Registra en historial los QR de un análisis servido desde analisis_cache"""
+    codigos = analisis_cache.datos_de(image_hash, "QR")
+    if codigos:
+        sex.registrar_codigos(usuario_id, codigos)
+
 
 # --- IMPLEMENTACIONES MÍNIMAS PARA FUNCIONES FALTANTES ---
 
@@ -241,6 +292,9 @@ def analizar_colores(ruta_imagen, usuario_id, image_hash, nombre):
 def analizar_calidad(ruta_imagen, usuario_id, image_hash, nombre):
     return "Calidad no implementada."
 
+# Marcadores que no leen la imagen: no hace falta descargarla ni cachearlos
+SIN_ARCHIVO = {analizar_metadata, analizar_seguridad, analizar_memes, analizar_colores, analizar_calidad}
+
 async def enviar_resultados_optimizados(mensaje, resultados: list, ruta_imagen: str):
     """Envía resultados de forma inteligente y eficiente"""
     if not resultados or all("Error" in r or "no disponible" in r.lower() for r in resultados):
@@ -266,19 +320,107 @@ async def enviar_resultados_optimizados(mensaje, resultados: list, ruta_imagen:
         with open(archivo_resultados, 'w', encoding='utf-8') as f:
             f.write("\n".join(resultados))
         
-        await mensaje.reply_document(
-            document=InputFile(archivo_resultados),
+        await file_ids.enviar(
+            mensaje, "documento", archivo_resultados,
             caption="📄 Resultados completos del análisis"
         )
         os.remove(archivo_resultados)
 
-async def procesar_descarga_url(url: str, usuario_id: int, mensaje):
+def _leer_pendientes() -> dict:
+    """Descargas que estaban en curso, indexadas por chat y mensaje"""
+    return persistencia.cargar_json(PENDIENTES_PATH) or {}
+
+def _guardar_pendientes(pendientes: dict):
+    persistencia.guardar_json(PENDIENTES_PATH, pendientes)
+
+def _clave_pendiente(mensaje) -> str:
+    return f"{mensaje.chat_id}:{mensaje.message_id}"
+
+def _marcar_pendiente(url: str, usuario_id: int, mensaje):
+    pendientes = _leer_pendientes()
+    anterior = pendientes.get(_clave_pendiente(mensaje), {})
+    pendientes[_clave_pendiente(mensaje)] = {
+        "url": url,
+        "usuario_id": usuario_id,
+        "chat_id": mensaje.chat_id,
+        "chat_type": mensaje.chat.type,
+        "message_id": mensaje.message_id,
+        # Una reanudación conserva sus intentos y la fecha original
+        "intentos": anterior.get("intentos", 0),
+        "desde": anterior.get("desde", time.time()),
+    }
+    _guardar_pendientes(pendientes)
+
+def _quitar_pendiente(mensaje):
+    pendientes = _leer_pendientes()
+    if pendientes.pop(_clave_pendiente(mensaje), None):
+        _guardar_pendientes(pendientes)
+
+async def reanudar_descargas(application):
+    """
+    post_init del bot: vuelve a encolar las descargas que quedaron a medias.
+    Los .part y manifiestos de chunked_downloader/yt-dlp hacen que continúen donde iban.
+    """
+    pendientes = _leer_pendientes()
+    ahora = time.time()
+    for clave, p in list(pendientes.items()):
+        # Una URL que tumba o cuelga el proceso no se repite en cada arranque para siempre
+        if p.get("intentos", 0) >= MAX_REANUDACIONES or ahora - p.get("desde", ahora) > MAX_EDAD_PENDIENTE:
+            logger.warning(f"[interprete] Descarga pendiente abandonada tras {p.get('intentos', 0)} "
+                           f"reanudaciones: {p['url']}")
+            del pendientes[clave]
+            continue
+        p["intentos"] = p.get("intentos", 0) + 1
+    # Se guarda antes de lanzar nada: si esta reanudación vuelve a tumbar el bot, ya cuenta
+    _guardar_pendientes(pendientes)
+
+    for p in pendientes.values():
+        # Mensaje mínimo para poder responder en el chat original
+        mensaje = Message(
+            message_id=p["message_id"],
+            date=datetime.now(),
+            chat=Chat(id=p["chat_id"], type=p.get("chat_type", Chat.PRIVATE)),
+        )
+        mensaje.set_bot(application.bot)
+        asyncio.create_task(procesar_descarga_url(p["url"], p["usuario_id"], mensaje))
+    if pendientes:
+        logger.info(f"[interprete] {len(pendientes)} descargas reanudadas tras reinicio")
+
+def _aviso_cola(url: str, usuario_id: int, compartido: bool) -> str:
+    """Mensaje al encolar: descargando ya o posición de espera del trabajo recién encolado"""
+    if not compartido:
+        cola = download_queue.estado()
+        # Los primeros turnos los toman los workers libres en cuanto el loop cede
+        puesto = download_queue.posicion(usuario_id) - (cola["workers"] - cola["activas"])
+        if puesto > 0:
+            return f"📥 En cola (posición {puesto}): {url[:50]}..."
+    return f"⚡ Descargando: {url[:50]}..."
+
+async def procesar_descarga_url(url: str, usuario_id: int, mensaje, avisar: bool = False):
     """Procesamiento de descargas en segundo plano: envío seguro en MP4"""
+    _marcar_pendiente(url, usuario_id, mensaje)
     try:
-        resultado = downloader.descargar(url, usuario_id)
+        # Acierto de media_cache: directo al envío, sin esperar turno detrás de otras descargas
+        resultado = await asyncio.to_thread(downloader.desde_cache, url, usuario_id)
+        compartido = False
+        if resultado is None:
+            # La descarga corre en el pool de download_queue, fuera del event loop.
+            # Pegadas simultáneas de la misma URL comparten una sola descarga.
+            clave = downloader.normalizar_url(downloader.limpiar_url_tiktok(url))
+            espera, compartido = download_queue.encolar_unico(
+                clave, usuario_id, downloader.descargar, url, usuario_id
+            )
+            if avisar:
+                await mensaje.reply_text(_aviso_cola(url, usuario_id, compartido))
+            resultado = await espera
         if resultado.get('status') != 'success':
             await mensaje.reply_text(f"❌ Error: {resultado.get('message', 'Error desconocido')}")
             return
+        if compartido:
+            # downloader solo registró al usuario que lanzó la descarga
+            # (en un hilo: con el buffer lleno registrar espera al volcador)
+            await asyncio.to_thread(historial.registrar, usuario_id, resultado.get('titulo', ''),
+                                    tipo=resultado.get('file_type'), url=url, duracion=resultado.get('duracion', 0))
 
         file_path = resultado.get('file_path')
         file_type = resultado.get('file_type')
@@ -289,48 +431,58 @@ async def procesar_descarga_url(url: str, usuario_id: int, mensaje):
 
         abs_path = os.path.abspath(file_path)
         nombre_archivo = os.path.basename(abs_path)
-        ruta_convertida = os.path.join("downloads/videos", f"tg_{nombre_archivo}.mp4")
-
-        # Convertir a MP4 compatible
-        try:
-            convertir_video_compatible(abs_path, ruta_convertida)
-        except Exception as conv_err:
-            await mensaje.reply_text(f"❌ Error al convertir el video: {str(conv_err)}")
-            return
-
-        if not os.path.exists(ruta_convertida):
-            await mensaje.reply_text(f"❌ No se encontró el archivo convertido: {ruta_convertida}")
-            return
 
-        # Enviar video
-        try:
-            await mensaje.reply_video(
-                video=InputFile(ruta_convertida),
-                caption="🎬 Video convertido y listo para Telegram"
-            )
-        except Exception as send_err:
-            await mensaje.reply_text(f"❌ Error al enviar el video: {send_err}")
-        finally:
-            # Limpiar archivo temporal
-            if os.path.exists(ruta_convertida):
-                os.remove(ruta_convertida)
+        # Fijados hasta terminar el envío: la limpieza de espacio no los toca
+        with storage_manager.fijados(abs_path, resultado.get('derivados', {}).get('tg')):
+            # La versión para Telegram queda en media_cache: un acierto la envía sin convertir
+            ruta_convertida = resultado.get('derivados', {}).get('tg')
+            if not ruta_convertida or not os.path.exists(ruta_convertida):
+                ruta_convertida = os.path.join("downloads/videos", f"tg_{nombre_archivo}.mp4")
+
+                # Convertir a MP4 compatible (una sola conversión aunque varios la pidan)
+                try:
+                    espera, _ = download_queue.encolar_unico(
+                        f"tg:{abs_path}", usuario_id,
+                        convertir_video_compatible, abs_path, ruta_convertida, resultado.get('codecs')
+                    )
+                    await espera
+                except Exception as conv_err:
+                    await mensaje.reply_text(f"❌ Error al convertir el video: {str(conv_err)}")
+                    return
+
+                if not os.path.exists(ruta_convertida):
+                    await mensaje.reply_text(f"❌ No se encontró el archivo convertido: {ruta_convertida}")
+                    return
+                media_cache.agregar_derivado(resultado.get('clave'), 'tg', ruta_convertida)
+                storage_manager.registrar_archivo(ruta_convertida)
+
+            # Enviar video con botones para pedir derivados bajo demanda
+            ref = derivados.referencia(abs_path)
+            botones = InlineKeyboardMarkup([[
+                InlineKeyboardButton("🎵 Audio", callback_data=f"deriv:audio:{ref}"),
+                InlineKeyboardButton("🖼️ Miniatura", callback_data=f"deriv:foto:{ref}"),
+                InlineKeyboardButton("📉 Comprimido", callback_data=f"deriv:comprimido:{ref}")
+            ]])
+            try:
+                await file_ids.enviar(
+                    mensaje, "video", ruta_convertida,
+                    caption="🎬 Video convertido y listo para Telegram",
+                    reply_markup=botones
+                )
+            except Exception as send_err:
+                await mensaje.reply_text(f"❌ Error al enviar el video: {send_err}")
 
     except Exception as e:
         await mensaje.reply_text(f"💥 Error crítico en descarga: {str(e)}")
+    finally:
+        _quitar_pendiente(mensaje)
 
-def convertir_video_compatible(ruta_entrada, ruta_salida):
-    """Convierte cualquier video a MP4 H.264 + AAC compatible Telegram"""
-    # Envolver rutas entre comillas para manejar espacios y caracteres raros
-    comando = [
-        "ffmpeg",
-        "-y",
-        "-i", ruta_entrada,  # FFmpeg puede manejar strings normales si lo pasas como lista
-        "-c:v", "libx264",
-        "-c:a", "aac",
-        "-movflags", "+faststart",
-        ruta_salida
-    ]
-    subprocess.run(comando, check=True)
+def convertir_video_compatible(ruta_entrada, ruta_salida, info: dict = None) -> str:
+    """
+    Deja el video como MP4 H.264 + AAC compatible Telegram recodificando solo lo necesario.
+    Devuelve el camino tomado: "remux", "video", "audio" o "completa".
+    """
+    return postproceso.procesar(ruta_entrada, salida_mp4=ruta_salida, info=info)["camino"]
 
 
 # FUNCIONES DE UTILIDAD ULTRA-RÁPIDAS
@@ -344,15 +496,6 @@ def detectar_tipo_contenido(mensaje) -> str:
     if mensaje.sticker: return "Sticker"
     return "Contenido desconocido"
 
-async def limpiar_archivo_temp(ruta: str):
-    """Limpieza asíncrona no bloqueante"""
-    try:
-        await asyncio.sleep(300)  # Limpiar después de 5 minutos
-        if os.path.exists(ruta):
-            os.remove(ruta)
-    except:
-        pass
-
 async def reintento_analisis(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Reintento automático con backoff exponencial"""
     for intento in range(3):
@@ -389,15 +532,3 @@ logger = logging.getLogger(__name__)
 def decodificar_qr(ruta_imagen: str) -> str:
     """Función legacy para compatibilidad"""
     return sex.decodificar_qr(ruta_imagen, 0)
-
-def convertir_video_compatible(ruta_entrada, ruta_salida):
-    comando = [
-        "ffmpeg",
-        "-y",
-        "-i", ruta_entrada,
-        "-c:v", "libx264",
-        "-c:a", "aac",
-        "-movflags", "+faststart",
-        ruta_salida
-    ]
-    subprocess.run(comando, check=True)
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+mantenimiento.py
+Planificador único de tareas de fondo del bot.
+Un solo bucle asyncio se encarga de:
+- Borrar archivos temporales al caducar (heap de vencimientos, sin una tarea dormida por archivo)
+- Barrer imagenes_temp/, imagenes_qr/ y config.TEMP_DIR por si quedó algo sin programar
+- Lanzar la eviction de storage_manager periódicamente, fuera del camino de cada descarga
+- Compactar los videos fríos (modulos/compressor)
+- Aplicar la retención del historial y compactar los diarios (modulos/historial)
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+
+import config
+from modulos import storage_manager, compressor, historial
+
+logger = logging.getLogger(__name__)
+
+TTL_TEMP = 300        # Segundos que vive un archivo temporal
+TICK = 5              # Resolución del planificador
+BARRIDO_CADA = 600    # Barrido completo de carpetas temporales
+LIMPIEZA_CADA = 30    # Chequeo del límite de almacenamiento
+COMPACTAR_CADA = 1800 # Ronda de compresión de videos fríos
+HISTORIAL_CADA = 24 * 3600  # Retención y compactación del historial
+
+# Carpetas temporales -> segundos que puede vivir un archivo sin programar
+CARPETAS_TEMP = {
+    "imagenes_temp": TTL_TEMP,
+    "imagenes_qr": TTL_TEMP,
+    str(config.TEMP_DIR): 3600,
+}
+
+_vencimientos = []           # (momento, secuencia, ruta)
+_periodicas = []             # (próxima ejecución, secuencia, intervalo, nombre, func)
+_secuencia = itertools.count()
+_tarea = None
+_en_marcha = {}              # nombre -> asyncio.Task de la tarea periódica que está corriendo
+
+def programar_borrado(ruta: str, ttl: float = TTL_TEMP):
+    """Borra `ruta` dentro de `ttl` segundos. O(log n), sin crear tareas."""
+    heapq.heappush(_vencimientos, (time.monotonic() + ttl, next(_secuencia), ruta))
+
+def cada(intervalo: float, func, nombre: str = None):
+    """
+    Registra una función bloqueante para ejecutarla cada `intervalo` segundos en un hilo.
+    La primera ejecución es en el siguiente tick. Cada tarea corre por su cuenta: una lenta
+    (p. ej. una ronda de ffmpeg) no retrasa a las demás, y no se solapa consigo misma.
+    """
+    nombre = nombre or getattr(func, "__name__", "tarea")
+    heapq.heappush(_periodicas, (time.monotonic(), next(_secuencia), intervalo, nombre, func))
+
+def _borrar(ruta: str):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"[mantenimiento] No se pudo borrar {ruta}: {e}")
+
+def barrer_temporales() -> int:
+    """Borra archivos de las carpetas temporales más viejos que su TTL (por mtime)"""
+    ahora = time.time()
+    borrados = 0
+    for carpeta, ttl in CARPETAS_TEMP.items():
+        pendientes = [carpeta]
+        while pendientes:
+            try:
+                entradas = list(os.scandir(pendientes.pop()))
+            except OSError:
+                continue
+            for entrada in entradas:
+                if entrada.is_dir(follow_symlinks=False):
+                    pendientes.append(entrada.path)
+                elif entrada.name.startswith("."):
+                    continue
+                elif ahora - entrada.stat().st_mtime > ttl:
+                    _borrar(entrada.path)
+                    borrados += 1
+    if borrados:
+        logger.info(f"[mantenimiento] Barrido: {borrados} temporales caducados eliminados")
+    return borrados
+
+async def _ejecutar(nombre: str, func):
+    try:
+        await asyncio.to_thread(func)
+    except Exception as e:
+        logger.error(f"[mantenimiento] Tarea {nombre} falló: {e}")
+    finally:
+        _en_marcha.pop(nombre, None)
+
+async def _bucle():
+    while True:
+        ahora = time.monotonic()
+
+        # Temporales vencidos: solo se tocan los que tocan, el resto sigue en el heap
+        caducados = []
+        while _vencimientos and _vencimientos[0][0] <= ahora:
+            caducados.append(heapq.heappop(_vencimientos)[2])
+        for ruta in caducados:
+            await asyncio.to_thread(_borrar, ruta)
+
+        while _periodicas and _periodicas[0][0] <= ahora:
+            _, _, intervalo, nombre, func = heapq.heappop(_periodicas)
+            if nombre not in _en_marcha:
+                _en_marcha[nombre] = asyncio.create_task(_ejecutar(nombre, func), name=nombre)
+            heapq.heappush(_periodicas, (ahora + intervalo, next(_secuencia),
+                                         intervalo, nombre, func))
+
+        await asyncio.sleep(TICK)
+
+def iniciar():
+    """Arranca el planificador (post_init del bot). La eviction pasa a hacerse aquí."""
+    global _tarea
+    if _tarea is not None:
+        return
+    cada(BARRIDO_CADA, barrer_temporales)
+    cada(LIMPIEZA_CADA, storage_manager.limpiar_espacio)
+    cada(COMPACTAR_CADA, compressor.compactar_frios)
+    cada(HISTORIAL_CADA, historial.compactar, "historial.compactar")
+    storage_manager.LIMPIEZA_EN_SEGUNDO_PLANO = True
+    _tarea = asyncio.create_task(_bucle(), name="mantenimiento")
+    logger.info(f"[mantenimiento] Planificador iniciado ({len(_periodicas)} tareas periódicas)")
+
+async def detener():
+    """Para el planificador (post_shutdown del bot); la eviction vuelve a ser en línea"""
+    global _tarea
+    if _tarea is None:
+        return
+    _tarea.cancel()
+    try:
+        await _tarea
+    except asyncio.CancelledError:
+        pass
+    _tarea = None
+    # Las tareas en curso terminan su hilo; solo se deja de esperar por ellas
+    tareas = list(_en_marcha.values())
+    for t in tareas:
+        t.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
+    _en_marcha.clear()
+    _periodicas.clear()
+    storage_manager.LIMPIEZA_EN_SEGUNDO_PLANO = False
@@ -0,0 +1,147 @@
+"""
+media_cache.py
+Caché persistente de medios ya descargados, compartida entre usuarios.
+Clave: extractor + id del video (o URL normalizada si no hay id).
+Cada entrada apunta al archivo en downloads/ y a sus artefactos derivados.
+"""
+
+import os
+import threading
+import logging
+from datetime import datetime
+from modulos import persistencia
+
+logger = logging.getLogger(__name__)
+
+INDICE_PATH = "downloads/.media_cache.json"
+
+_lock = threading.RLock()
+_entradas = None  # clave -> {file_path, file_type, titulo, url, duracion, derivados, fecha}
+_alias = {}       # url normalizada -> clave
+_por_ruta = {}    # ruta absoluta -> (clave, nombre del derivado o None si es el archivo principal)
+
+def _ruta_abs(ruta: str) -> str:
+    return os.path.abspath(ruta)
+
+def _cargar():
+    """Carga el índice del disco la primera vez que se usa"""
+    global _entradas, _alias
+    if _entradas is not None:
+        return
+    datos = persistencia.cargar_json(INDICE_PATH) or {}
+    _entradas = datos.get("entradas", {})
+    _alias = datos.get("alias", {})
+    _por_ruta.clear()
+    for clave, entrada in _entradas.items():
+        _indexar_rutas(clave, entrada)
+
+def _indexar_rutas(clave: str, entrada: dict):
+    _por_ruta[_ruta_abs(entrada["file_path"])] = (clave, None)
+    for nombre, ruta in entrada.get("derivados", {}).items():
+        _por_ruta[_ruta_abs(ruta)] = (clave, nombre)
+
+def _desindexar_rutas(entrada: dict):
+    _por_ruta.pop(_ruta_abs(entrada["file_path"]), None)
+    for ruta in entrada.get("derivados", {}).values():
+        _por_ruta.pop(_ruta_abs(ruta), None)
+
+def _persistir():
+    persistencia.guardar_json(INDICE_PATH, {"entradas": _entradas, "alias": _alias})
+
+def clave_de(info: dict, url_normalizada: str) -> str:
+    """Clave canónica: id del extractor si yt-dlp lo da, si no la URL normalizada"""
+    if info and info.get("id") and (info.get("extractor_key") or info.get("extractor")):
+        return f"{info.get('extractor_key') or info.get('extractor')}:{info['id']}"
+    return url_normalizada
+
+def _vigente(clave: str):
+    """Devuelve la entrada si su archivo sigue en disco; si no, la invalida"""
+    entrada = _entradas.get(clave)
+    if not entrada:
+        return None
+    if not os.path.exists(entrada["file_path"]):
+        _eliminar_entrada(clave)
+        _persistir()
+        return None
+    # Derivados borrados por fuera del bot: se olvidan
+    perdidos = [n for n, r in entrada.get("derivados", {}).items() if not os.path.exists(r)]
+    for nombre in perdidos:
+        _por_ruta.pop(_ruta_abs(entrada["derivados"].pop(nombre)), None)
+    if perdidos:
+        _persistir()
+    return dict(entrada, clave=clave)
+
+def buscar(url_normalizada: str):
+    """Busca por URL (sin extraer metadata). Devuelve la entrada o None."""
+    with _lock:
+        _cargar()
+        clave = _alias.get(url_normalizada)
+        return _vigente(clave) if clave else None
+
+def buscar_clave(clave: str, url_normalizada: str = None):
+    """Busca por clave canónica y, si hay acierto, recuerda la URL como alias"""
+    with _lock:
+        _cargar()
+        entrada = _vigente(clave)
+        if entrada and url_normalizada and _alias.get(url_normalizada) != clave:
+            _alias[url_normalizada] = clave
+            _persistir()
+        return entrada
+
+def guardar(clave: str, url_normalizada: str, file_path: str, file_type: str,
+            titulo: str, duracion=0, derivados: dict = None):
+    """Registra un medio recién descargado"""
+    with _lock:
+        _cargar()
+        if clave in _entradas:
+            _desindexar_rutas(_entradas[clave])
+        entrada = {
+            "file_path": file_path,
+            "file_type": file_type,
+            "titulo": titulo,
+            "url": url_normalizada,
+            "duracion": duracion,
+            "derivados": dict(derivados or {}),
+            "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        _entradas[clave] = entrada
+        _alias[url_normalizada] = clave
+        _indexar_rutas(clave, entrada)
+        _persistir()
+
+def agregar_derivado(clave: str, nombre: str, ruta: str):
+    """Asocia un artefacto derivado (audio, foto, versión para Telegram...) a una entrada"""
+    with _lock:
+        _cargar()
+        entrada = _entradas.get(clave)
+        if not entrada:
+            return
+        entrada.setdefault("derivados", {})[nombre] = ruta
+        _por_ruta[_ruta_abs(ruta)] = (clave, nombre)
+        _persistir()
+
+def _eliminar_entrada(clave: str):
+    entrada = _entradas.pop(clave, None)
+    if not entrada:
+        return
+    for url in [u for u, c in _alias.items() if c == clave]:
+        del _alias[url]
+    _desindexar_rutas(entrada)
+
+def invalidar_ruta(ruta: str):
+    """
+    Llamado por storage_manager al borrar un archivo.
+    Si es el archivo principal se invalida la entrada; si es un derivado, solo ese derivado.
+    """
+    with _lock:
+        _cargar()
+        ref = _por_ruta.pop(_ruta_abs(ruta), None)
+        if not ref:
+            return
+        clave, nombre = ref
+        if nombre is None:
+            _eliminar_entrada(clave)
+            logger.info(f"[media_cache] Entrada invalidada por eviction: {clave}")
+        else:
+            _entradas.get(clave, {}).get("derivados", {}).pop(nombre, None)
+        _persistir()
@@ -0,0 +1,47 @@
+"""
+persistencia.py
+Estado en disco compartido por los módulos del bot: índices JSON con escritura
+atómica (un corte nunca los deja a medias) y conexiones SQLite por hilo.
+"""
+
+import os
+import json
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+def cargar_json(ruta: str):
+    """Contenido del JSON en `ruta`; None si no existe o está ilegible (se avisa y se empieza vacío)"""
+    if not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"[persistencia] Índice ilegible, se empieza vacío: {ruta}: {e}")
+        return None
+
+def escribir_atomico(ruta: str, texto: str):
+    """Escribe en un .tmp y lo renombra encima: quien lea ve el archivo viejo o el nuevo entero"""
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        f.write(texto)
+    os.replace(ruta + ".tmp", ruta)
+
+def guardar_json(ruta: str, datos):
+    escribir_atomico(ruta, json.dumps(datos, ensure_ascii=False))
+
+def conexion_por_hilo(local, ruta: str, esquema: str) -> sqlite3.Connection:
+    """
+    Conexión del hilo actual guardada en `local` (threading.local: sqlite3 no se comparte
+    entre hilos), en modo WAL y con el esquema creado.
+    """
+    conexion = getattr(local, "conexion", None)
+    if conexion is None:
+        conexion = sqlite3.connect(ruta, timeout=30)
+        conexion.row_factory = sqlite3.Row
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")  # Seguro con WAL, fsync solo en checkpoints
+        conexion.executescript(esquema)
+        local.conexion = conexion
+    return conexion
@@ -0,0 +1,137 @@
+"""
+postproceso.py
+Post-procesado de videos descargados en una sola pasada de ffmpeg.
+Un único proceso demuxea/decodifica la entrada una vez y produce a la vez
+el MP4 compatible con Telegram, el audio y la miniatura.
+"""
+
+import json
+import logging
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Códecs que Telegram reproduce tal cual dentro de un MP4
+CODECS_VIDEO_OK = {"h264"}
+CODECS_AUDIO_OK = {"aac", "mp3"}
+PIX_FMT_OK = {"yuv420p", "yuvj420p"}
+
+# Cuántas conversiones tomaron cada camino (para medir el ahorro del remux)
+ESTADISTICAS_CONVERSION = {"remux": 0, "video": 0, "audio": 0, "completa": 0}
+
+def sondear_codecs(ruta: str, info: dict = None) -> dict:
+    """
+    Códecs del primer stream de video y de audio.
+    Usa ffprobe; si no está disponible, los códecs que reportó yt-dlp en el info dict.
+    """
+    try:
+        salida = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "stream=codec_type,codec_name,pix_fmt",
+             "-of", "json", ruta],
+            capture_output=True, text=True, check=True
+        )
+        streams = json.loads(salida.stdout).get("streams", [])
+        video = next((s for s in streams if s.get("codec_type") == "video"), {})
+        audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+        return {"video": video.get("codec_name"), "pix_fmt": video.get("pix_fmt"),
+                "audio": audio.get("codec_name")}
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        logger.warning(f"[postproceso] ffprobe no disponible para {ruta}: {e}")
+
+    if not info:
+        return {}
+    # yt-dlp usa nombres tipo 'avc1.64001F' / 'mp4a.40.2' / 'none'
+    alias = {"avc1": "h264", "h264": "h264", "mp4a": "aac", "aac": "aac", "mp3": "mp3"}
+    vcodec = (info.get("vcodec") or "none").split(".")[0]
+    acodec = (info.get("acodec") or "none").split(".")[0]
+    return {"video": alias.get(vcodec, vcodec) if vcodec != "none" else None,
+            "pix_fmt": None,
+            "audio": alias.get(acodec, acodec) if acodec != "none" else None}
+
+def _camino(codecs: dict):
+    """Qué streams hay que recodificar para el MP4 de Telegram"""
+    video_ok = codecs.get("video") in CODECS_VIDEO_OK and codecs.get("pix_fmt") in PIX_FMT_OK | {None}
+    # Sin stream de audio no hay nada que recodificar
+    audio_ok = codecs.get("audio") in CODECS_AUDIO_OK or (bool(codecs) and codecs.get("audio") is None)
+
+    if video_ok and audio_ok:
+        camino = "remux"
+    elif video_ok:
+        camino = "audio"
+    elif audio_ok:
+        camino = "video"
+    else:
+        camino = "completa"
+    return camino, video_ok, audio_ok
+
+def procesar(ruta_entrada: str, salida_mp4: str = None, salida_audio: str = None,
+             salida_foto: str = None, info: dict = None, tiempo_foto: str = "00:00:01") -> dict:
+    """
+    Genera en una sola invocación de ffmpeg las salidas pedidas:
+    - salida_mp4: MP4 H.264 + AAC para Telegram (remux o recodificación solo de lo necesario)
+    - salida_audio: pista de audio (.mp3, o .m4a copiando el AAC si la fuente ya lo es)
+    - salida_foto: fotograma en tiempo_foto como miniatura
+    Devuelve {"camino": ..., "mp4": ..., "audio": ..., "foto": ...} con las salidas generadas.
+    """
+    codecs = sondear_codecs(ruta_entrada, info)
+    camino, video_ok, audio_ok = _camino(codecs)
+    hay_audio = codecs.get("audio") is not None or not codecs
+
+    comando = ["ffmpeg", "-y", "-i", ruta_entrada]
+    salidas = {}
+
+    if salida_mp4:
+        comando += ["-map", "0:v:0", "-map", "0:a:0?",
+                    "-c:v", "copy" if video_ok else "libx264",
+                    "-c:a", "copy" if audio_ok else "aac"]
+        if not video_ok:
+            comando += ["-pix_fmt", "yuv420p"]
+        comando += ["-movflags", "+faststart", salida_mp4]
+        salidas["mp4"] = salida_mp4
+
+    if salida_audio and hay_audio:
+        if salida_audio.lower().endswith(".m4a"):
+            codec_audio = ["-c:a", "copy"] if codecs.get("audio") == "aac" else ["-c:a", "aac"]
+        else:
+            codec_audio = ["-c:a", "libmp3lame", "-q:a", "2"]
+        comando += ["-map", "0:a:0", "-vn", *codec_audio, salida_audio]
+        salidas["audio"] = salida_audio
+
+    if salida_foto:
+        comando += ["-map", "0:v:0", "-ss", tiempo_foto, "-frames:v", "1", salida_foto]
+        salidas["foto"] = salida_foto
+
+    if not salidas:
+        return {"camino": None}
+
+    proceso = subprocess.run(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proceso.returncode != 0:
+        raise RuntimeError(f"ffmpeg falló: {proceso.stderr.decode(errors='ignore')[-500:]}")
+
+    resultado = {"camino": camino if salida_mp4 else None, **salidas}
+    if salida_mp4:
+        ESTADISTICAS_CONVERSION[camino] += 1
+    logger.info(f"[postproceso] {ruta_entrada}: {', '.join(salidas)} en una pasada "
+                f"(mp4: {resultado['camino'] or '-'}, códecs: {codecs or 'sin sondeo'})")
+    return resultado
+
+def comprimir(ruta_entrada: str, salida_mp4: str, crf: int = 28, altura_max: int = 720,
+              preset: str = "veryfast", hilos: int = 0) -> str:
+    """
+    Versión más ligera del video: H.264 con CRF alto y altura limitada, audio AAC 96k.
+    hilos=0 deja que ffmpeg decida; un número bajo limita el uso de CPU.
+    """
+    comando = [
+        "ffmpeg", "-y", "-i", ruta_entrada,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale=-2:'min({altura_max},ih)'",
+        "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "96k",
+        "-threads", str(hilos),
+        "-movflags", "+faststart", salida_mp4
+    ]
+    proceso = subprocess.run(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proceso.returncode != 0:
+        raise RuntimeError(f"ffmpeg falló: {proceso.stderr.decode(errors='ignore')[-500:]}")
+    logger.info(f"[postproceso] Versión comprimida (crf {crf}, ≤{altura_max}p): {salida_mp4}")
+    return salida_mp4
@@ -36,4 +36,16 @@ def priorizar_tarea(tarea_name="tarea"):
     if cpu_libre < 50:
         logger.info(f"[resource_manager] Recursos bajos, retrasando {tarea_name}")
         return False
-    return True
\ No newline at end of file
+    return True
+
+def presupuesto_cpu(fraccion=0.25, min_cpu=30):
+    """
+    Hilos que puede usar una tarea de fondo sin estorbar a las descargas:
+    una fracción de los núcleos libres ahora mismo, 0 si el CPU está ocupado.
+    """
+    cpu_libre = 100 - psutil.cpu_percent(interval=0.5)
+    if cpu_libre < min_cpu:
+        logger.info(f"[resource_manager] CPU ocupada ({cpu_libre:.0f}% libre), sin presupuesto")
+        return 0
+    nucleos_libres = (psutil.cpu_count() or 1) * cpu_libre / 100
+    return max(1, int(nucleos_libres * fraccion))
@@ -10,21 +10,31 @@ from pyzbar import pyzbar
 from modulos import historial
 import validators
 
-def decodificar_qr(ruta_imagen: str, usuario_id: int):
+def leer_codigos(ruta_imagen: str):
+    """(tipo, datos) de cada QR de la imagen; None si no se pudo cargar"""
+    imagen = cv2.imread(ruta_imagen)
+    if imagen is None:
+        return None
+    return [(codigo.type, codigo.data.decode('utf-8')) for codigo in pyzbar.decode(imagen)]
+
+def registrar_codigos(usuario_id: int, codigos):
+    """Registra en historial cada QR leído (también cuando el análisis sale de la caché)"""
+    for tipo_qr, datos in codigos:
+        historial.registrar(usuario_id, f"QR_{tipo_qr}", tipo="qr", url=datos)
+
+def decodificar_qr(ruta_imagen: str, usuario_id: int, codigos=None):
     """
     Decodifica todos los códigos QR en la imagen y determina tipo: WiFi, URL, Email, texto plano.
-    Registra automáticamente en historial.
+    Registra automáticamente en historial. `codigos` evita volver a leer la imagen si ya se leyó.
     """
-    imagen = cv2.imread(ruta_imagen)
-    if imagen is None:
+    if codigos is None:
+        codigos = leer_codigos(ruta_imagen)
+    if codigos is None:
         return "[sex] Error: no se pudo cargar la imagen."
 
-    codigos = pyzbar.decode(imagen)
     resultados = []
 
-    for codigo in codigos:
-        datos = codigo.data.decode('utf-8')
-        tipo_qr = codigo.type
+    for tipo_qr, datos in codigos:
         info_extra = ""
 
         # Intentar detectar QR tipo WiFi (formato estándar: WIFI:T:WPA;S:SSID;P:PASS;;)
@@ -48,8 +58,8 @@ def decodificar_qr(ruta_imagen: str, usuario_id: int):
 
         resultados.append(resultado)
 
-        # Registrar en historial
-        historial.registrar(usuario_id, f"QR_{tipo_qr}", tipo="qr", url=datos)
+    # Registrar en historial
+    registrar_codigos(usuario_id, codigos)
 
     if not resultados:
         return "[sex] No se detectó ningún QR."
@@ -1,14 +1,34 @@
 """
 storage_manager.py
 Organiza archivos de SouaweakBot y mantiene espacio libre en la laptop.
+Lleva un índice persistente de los archivos de downloads/ con el total de bytes
+y un heap en orden de eviction, para no recorrer el disco en cada guardado.
+El orden lo decide la política de config.EVICTION_POLICY (ver POLITICAS).
+Los archivos guardados se deduplican por contenido: una sola copia en downloads/.blobs/
+y hardlinks desde las carpetas de categoría; el total cuenta cada inodo una vez.
 """
 
 import os
+import heapq
+import atexit
 import shutil
+import time
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from modulos import media_cache, derivados, file_ids, persistencia
+
+import config
 
 DOWNLOAD_PATH = "downloads/"
-LIMITE_GB = 20  # Límite total antes de limpiar
+LIMITE_GB = config.STORAGE_LIMIT_GB  # Límite total antes de limpiar
+INDICE_PATH = os.path.join(DOWNLOAD_PATH, ".storage_index.json")
+BLOBS_PATH = os.path.join(DOWNLOAD_PATH, ".blobs")  # Contenido único, nombrado por su SHA-256
+PERSISTIR_CADA = 5  # Segundos: agrupa escrituras del índice
+EXCLUIDOS = {os.path.abspath(os.path.join(DOWNLOAD_PATH, "historial"))}
+EXTENSIONES_EN_CURSO = (".part", ".part.json", ".ytdl", ".tmp")  # Descargas a medias y sus manifiestos: no cuentan ni se borran
+# Con el planificador de modulos/mantenimiento activo, guardar_archivo no limpia en línea
+LIMPIEZA_EN_SEGUNDO_PLANO = False
 
 # Carpetas por categoría
 CARPETAS = {
@@ -23,8 +43,327 @@ CARPETAS = {
 for c in CARPETAS.values():
     os.makedirs(c, exist_ok=True)
 
+# Políticas de eviction: prioridad de un archivo, se borra primero la menor.
+# `inflacion` es la prioridad del último evictado (el "L" de GDSF); las demás la ignoran.
+POLITICAS = {
+    # El más antiguo en disco (comportamiento original)
+    "mtime": lambda a, inflacion: a["mtime"],
+    # El que lleva más tiempo sin pedirse
+    "lru": lambda a, inflacion: a["ultimo_acceso"],
+    # El menos pedido; a igualdad, el que lleva más tiempo sin pedirse
+    "lfu": lambda a, inflacion: (a["accesos"], a["ultimo_acceso"]),
+    # Greedy-Dual-Size-Frequency: frecuencia por byte, con envejecimiento vía inflacion
+    "gdsf": lambda a, inflacion: inflacion + a["accesos"] / max(a["tamaño"], 1),
+}
+POLITICA = config.EVICTION_POLICY
+# Copias que se regeneran baratas a partir del original (remux tg_ para Telegram):
+# se evictan antes que cualquier otro archivo, sea cual sea la política
+PREFIJOS_REGENERABLES = ("tg_",)
+
+_lock = threading.RLock()
+_archivos = None   # ruta absoluta -> {"tamaño", "mtime", "accesos", "ultimo_acceso", "inodo", "blob", "version"}
+_total_bytes = 0   # Bytes reales en disco: un inodo con varios hardlinks cuenta una vez
+_inodos = {}       # (st_dev, st_ino) -> nº de rutas indexadas que lo comparten
+_heap = []         # (clase, prioridad, version, ruta); entradas obsoletas se descartan al sacarlas
+_version = 0
+_inflacion = 0.0
+_temporizador = None
+_fijados = {}      # ruta absoluta -> nº de usos en curso (subidas, conversiones...)
+
+# Contadores para comparar políticas (persisten con el índice)
+ESTADISTICAS = {"aciertos": 0, "fallos": 0, "bytes_evictados": 0, "archivos_evictados": 0}
+
+def _ignorado(nombre: str) -> bool:
+    """Índices internos (.media_cache, .storage_index...) y descargas sin terminar"""
+    return nombre.startswith(".") or nombre.endswith(EXTENSIONES_EN_CURSO)
+
+def _escanear(carpeta: str):
+    """Recorre downloads/ con scandir: el stat viene con la entrada del directorio"""
+    try:
+        entradas = list(os.scandir(carpeta))
+    except OSError:
+        return
+    for entrada in entradas:
+        if entrada.is_dir(follow_symlinks=False):
+            if os.path.abspath(entrada.path) not in EXCLUIDOS and not entrada.name.startswith("."):
+                yield from _escanear(entrada.path)
+        elif entrada.is_file(follow_symlinks=False) and not _ignorado(entrada.name):
+            st = entrada.stat(follow_symlinks=False)
+            yield os.path.abspath(entrada.path), st.st_size, st.st_mtime, (st.st_dev, st.st_ino)
+
+def _encolar(ruta: str, archivo: dict):
+    """(Re)calcula la prioridad del archivo y lo mete al heap (llamar con _lock)"""
+    global _version
+    _version += 1
+    archivo["version"] = _version
+    clase = 0 if os.path.basename(ruta).startswith(PREFIJOS_REGENERABLES) else 1
+    heapq.heappush(_heap, (clase, POLITICAS[POLITICA](archivo, _inflacion), _version, ruta))
+    # Cada acceso deja una entrada obsoleta; si el disco nunca se llena, nadie las saca
+    if len(_heap) > 2 * len(_archivos) + 64:
+        _compactar_heap()
+
+def _compactar_heap():
+    """Deja en el heap solo la entrada vigente de cada archivo, con su prioridad (llamar con _lock)"""
+    _heap[:] = [e for e in _heap if _archivos.get(e[3], {}).get("version") == e[2]]
+    heapq.heapify(_heap)
+
+def _agregar(ruta: str, tamaño: int, mtime: float, inodo=None, accesos: int = 1,
+             ultimo_acceso: float = None, blob: str = None):
+    """Inserta o actualiza un archivo en el índice (llamar con _lock)"""
+    global _total_bytes
+    anterior = _archivos.get(ruta)
+    if anterior:
+        _quitar(ruta)
+        accesos, ultimo_acceso = anterior["accesos"], anterior["ultimo_acceso"]
+        blob = blob or anterior.get("blob")
+    archivo = _archivos[ruta] = {"tamaño": tamaño, "mtime": mtime, "accesos": accesos,
+                                 "ultimo_acceso": ultimo_acceso or mtime, "inodo": inodo, "blob": blob}
+    # Otro hardlink del mismo inodo ya está contado
+    if inodo is None or not _inodos.get(inodo):
+        _total_bytes += tamaño
+    if inodo is not None:
+        _inodos[inodo] = _inodos.get(inodo, 0) + 1
+    _encolar(ruta, archivo)
+
+def _quitar(ruta: str) -> int:
+    """
+    Saca un archivo del índice; su entrada del heap queda obsoleta (llamar con _lock).
+    Devuelve los bytes que deja de ocupar (0 si otro hardlink sigue usando el inodo).
+    """
+    global _total_bytes
+    anterior = _archivos.pop(ruta, None)
+    if not anterior:
+        return 0
+    inodo = anterior.get("inodo")
+    if inodo is not None:
+        _inodos[inodo] -= 1
+        if _inodos[inodo]:
+            return 0
+        del _inodos[inodo]
+    _total_bytes -= anterior["tamaño"]
+    return anterior["tamaño"]
+
+def _cargar():
+    """
+    Carga el índice guardado y lo concilia con el disco en una pasada de scandir:
+    archivos nuevos o modificados se (re)indexan y los desaparecidos se olvidan.
+    """
+    global _archivos, _total_bytes, _heap, _inflacion
+    if _archivos is not None:
+        return
+    datos = persistencia.cargar_json(INDICE_PATH) or {}  # Sin índice: se reconstruye del disco
+    guardado = datos.get("archivos", {})
+    ESTADISTICAS.update(datos.get("estadisticas", {}))
+    _inflacion = datos.get("inflacion", 0.0)
+
+    _archivos, _total_bytes, _heap = {}, 0, []
+    _inodos.clear()
+    cambios = 0
+    for ruta, tamaño, mtime, inodo in _escanear(DOWNLOAD_PATH):
+        previo = guardado.pop(ruta, None)
+        if not previo or previo["tamaño"] != tamaño or previo["mtime"] != mtime:
+            cambios += 1
+            previo = None
+        if previo:
+            _agregar(ruta, tamaño, mtime, inodo, previo.get("accesos", 1),
+                     previo.get("ultimo_acceso"), previo.get("blob"))
+        else:
+            _agregar(ruta, tamaño, mtime, inodo)
+    cambios += len(guardado)  # Borrados por fuera del bot
+    _purgar_blobs()
+
+    if cambios:
+        _persistir()
+    print(f"[storage_manager] Índice listo: {len(_archivos)} archivos, "
+          f"{_total_bytes / (1024 ** 3):.2f} GB ({cambios} cambios desde el último arranque), "
+          f"política {POLITICA}")
+
+def _persistir():
+    """Escritura atómica del índice"""
+    global _temporizador
+    with _lock:
+        _temporizador = None
+        datos = {
+            "archivos": {ruta: {k: a[k] for k in ("tamaño", "mtime", "accesos", "ultimo_acceso", "blob")}
+                         for ruta, a in _archivos.items()},
+            "estadisticas": ESTADISTICAS,
+            "inflacion": _inflacion,
+        }
+        persistencia.guardar_json(INDICE_PATH, datos)
+
+def _persistir_pronto():
+    """Agenda una escritura del índice; varios cambios seguidos se guardan juntos"""
+    global _temporizador
+    if _temporizador is None:
+        _temporizador = threading.Timer(PERSISTIR_CADA, _persistir)
+        _temporizador.daemon = True
+        _temporizador.start()
+
+@atexit.register
+def _persistir_al_salir():
+    if _temporizador is not None:
+        _temporizador.cancel()
+        _persistir()
+
+def _purgar_blobs():
+    """Borra blobs que ya no enlaza ninguna ruta (st_nlink == 1: solo el propio blob)"""
+    purgados = 0
+    for carpeta in (os.scandir(BLOBS_PATH) if os.path.isdir(BLOBS_PATH) else ()):
+        if not carpeta.is_dir(follow_symlinks=False):
+            continue
+        for blob in os.scandir(carpeta.path):
+            try:
+                if blob.stat(follow_symlinks=False).st_nlink <= 1:
+                    os.remove(blob.path)
+                    purgados += 1
+            except OSError:
+                pass
+    if purgados:
+        print(f"[storage_manager] {purgados} blobs huérfanos eliminados")
+
+def _deduplicar(ruta: str):
+    """
+    Hashea el archivo en streaming y lo deja como hardlink de su blob.
+    Si el contenido ya existía, la ruta pasa a apuntar al blob existente y la copia se libera.
+    Devuelve la ruta del blob, o None si el sistema de archivos no admite hardlinks.
+    """
+    try:
+        digest = file_ids.hash_contenido(ruta)
+        blob = os.path.join(BLOBS_PATH, digest[:2], digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if not os.path.exists(blob):
+            os.link(ruta, blob)
+        elif not os.path.samefile(blob, ruta):
+            temporal = ruta + ".tmp"
+            os.link(blob, temporal)
+            os.replace(temporal, ruta)  # Atómico: la ruta nunca queda vacía
+            print(f"[storage_manager] Contenido duplicado, enlazado a {digest[:12]}: {ruta}")
+        return blob
+    except OSError as e:
+        print(f"[storage_manager] Sin deduplicación para {ruta}: {e}")
+        return None
+
+def registrar_archivo(ruta: str, blob: str = None):
+    """Indexa un archivo escrito en downloads/ (descarga, conversión, derivado...)"""
+    if _ignorado(os.path.basename(ruta)):
+        return
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        return
+    with _lock:
+        _cargar()
+        _agregar(os.path.abspath(ruta), st.st_size, st.st_mtime, (st.st_dev, st.st_ino), blob=blob)
+        _persistir_pronto()
+
+def olvidar_archivo(ruta: str):
+    """Quita del índice un archivo borrado"""
+    with _lock:
+        _cargar()
+        if os.path.abspath(ruta) in _archivos:
+            _quitar(os.path.abspath(ruta))
+            _persistir_pronto()
+
+def registrar_acceso(*rutas):
+    """Un medio ya descargado se volvió a servir (acierto de caché): sube la prioridad de sus archivos"""
+    with _lock:
+        _cargar()
+        ESTADISTICAS["aciertos"] += 1
+        for ruta in rutas:
+            archivo = _archivos.get(os.path.abspath(ruta))
+            if archivo:
+                archivo["accesos"] += 1
+                archivo["ultimo_acceso"] = time.time()
+                _encolar(os.path.abspath(ruta), archivo)
+        _persistir_pronto()
+
+def registrar_fallo():
+    """Un medio pedido no estaba en disco y hubo que descargarlo"""
+    with _lock:
+        _cargar()
+        ESTADISTICAS["fallos"] += 1
+        _persistir_pronto()
+
+def fijar(ruta: str):
+    """Protege un archivo de la eviction mientras se usa (subida, conversión...)"""
+    ruta = os.path.abspath(ruta)
+    with _lock:
+        _fijados[ruta] = _fijados.get(ruta, 0) + 1
+
+def liberar(ruta: str):
+    ruta = os.path.abspath(ruta)
+    with _lock:
+        if _fijados.get(ruta, 0) > 1:
+            _fijados[ruta] -= 1
+        else:
+            _fijados.pop(ruta, None)
+
+@contextmanager
+def fijados(*rutas):
+    """with storage_manager.fijados(ruta_a, ruta_b): ... — ignora rutas vacías"""
+    rutas = [r for r in rutas if r]
+    for ruta in rutas:
+        fijar(ruta)
+    try:
+        yield
+    finally:
+        for ruta in rutas:
+            liberar(ruta)
+
+def archivos_frios(carpeta: str, inactivo_segundos: float, tamaño_minimo: int = 0, excluir=None) -> list:
+    """
+    Archivos de `carpeta` sin pedirse desde hace `inactivo_segundos`, del más frío al menos.
+    Excluye los fijados y aquellos para los que `excluir(ruta)` es True. Devuelve [(ruta, tamaño)].
+    """
+    carpeta = os.path.join(os.path.abspath(carpeta), "")
+    limite = time.time() - inactivo_segundos
+    with _lock:
+        _cargar()
+        frios = [(a["ultimo_acceso"], ruta, a["tamaño"]) for ruta, a in _archivos.items()
+                 if ruta.startswith(carpeta) and a["ultimo_acceso"] < limite
+                 and a["tamaño"] >= tamaño_minimo and ruta not in _fijados]
+    return [(ruta, tamaño) for _, ruta, tamaño in sorted(frios) if not (excluir and excluir(ruta))]
+
+def reemplazar_contenido(ruta: str, ruta_nueva: str):
+    """
+    Sustituye atómicamente el contenido de `ruta` por el archivo `ruta_nueva`.
+    Las demás rutas indexadas que compartían inodo (hardlinks) pasan al contenido nuevo,
+    el blob viejo se borra si queda huérfano y el nuevo se deduplica como cualquier guardado.
+    """
+    ruta = os.path.abspath(ruta)
+    with _lock:
+        _cargar()
+        actual = _archivos.get(ruta) or {}
+        inodo, blob_viejo = actual.get("inodo"), actual.get("blob")
+        hermanos = [r for r, a in _archivos.items() if inodo and a.get("inodo") == inodo and r != ruta]
+
+    os.replace(ruta_nueva, ruta)
+    blob = _deduplicar(ruta)
+    for hermano in hermanos:
+        temporal = hermano + ".tmp"
+        os.link(ruta, temporal)
+        os.replace(temporal, hermano)
+    if blob_viejo and os.path.exists(blob_viejo) and os.stat(blob_viejo).st_nlink <= 1:
+        os.remove(blob_viejo)
+    for r in [ruta, *hermanos]:
+        registrar_archivo(r, blob)
+    return hermanos
+
+def estadisticas() -> dict:
+    """Contadores de la caché de descargas, para /stats"""
+    with _lock:
+        _cargar()
+        pedidos = ESTADISTICAS["aciertos"] + ESTADISTICAS["fallos"]
+        return dict(ESTADISTICAS, politica=POLITICA, archivos=len(_archivos),
+                    total_gb=_total_bytes / (1024 ** 3), limite_gb=LIMITE_GB,
+                    tasa_aciertos=ESTADISTICAS["aciertos"] / pedidos if pedidos else 0.0)
+
 def espacio_total_gb(path=DOWNLOAD_PATH):
-    """Calcula espacio total ocupado en GB"""
+    """Calcula espacio total ocupado en GB (desde el índice si es downloads/)"""
+    if os.path.abspath(path) == os.path.abspath(DOWNLOAD_PATH):
+        with _lock:
+            _cargar()
+            return _total_bytes / (1024 ** 3)
     total_bytes = 0
     for dirpath, dirnames, filenames in os.walk(path):
         for f in filenames:
@@ -32,30 +371,60 @@ def espacio_total_gb(path=DOWNLOAD_PATH):
             total_bytes += os.path.getsize(fp)
     return total_bytes / (1024 ** 3)
 
+def _borrar(ruta: str, blob: str = None):
+    """Borra un archivo evictado y todo lo que colgaba de él"""
+    os.remove(ruta)
+    # Último hardlink fuera: el blob ya no lo usa nadie
+    if blob and os.path.exists(blob) and os.stat(blob).st_nlink <= 1:
+        os.remove(blob)
+    media_cache.invalidar_ruta(ruta)
+    # Los derivados generados bajo demanda se van con su padre
+    for derivado in derivados.invalidar_ruta(ruta):
+        olvidar_archivo(derivado)
+        print(f"[storage_manager] Derivado eliminado con su padre: {derivado}")
+    print(f"[storage_manager] Archivo eliminado para liberar espacio: {ruta}")
+
 def limpiar_espacio():
     """
-    Si el total supera LIMITE_GB, elimina archivos más antiguos primero.
+    Si el total supera LIMITE_GB, elimina archivos en el orden de la política activa.
+    Cada eviction es un pop del heap: O(log n), sin recorrer el disco.
+    Los archivos fijados (en uso) se saltan y vuelven al heap al terminar.
     """
-    total_gb = espacio_total_gb()
-    if total_gb <= LIMITE_GB:
-        return False
+    global _inflacion
+    limite = LIMITE_GB * (1024 ** 3)
+    with _lock:
+        _cargar()
+        if _total_bytes <= limite:
+            return False
 
-    archivos = []
-    for dirpath, dirnames, filenames in os.walk(DOWNLOAD_PATH):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            archivos.append((fp, os.path.getmtime(fp)))
-
-    # Ordenar por fecha de modificación (antiguos primero)
-    archivos.sort(key=lambda x: x[1])
-
-    while espacio_total_gb() > LIMITE_GB and archivos:
-        file_to_remove, _ = archivos.pop(0)
+    saltados = []
+    while True:
+        with _lock:
+            if _total_bytes <= limite or not _heap:
+                break
+            clase, prioridad, version, ruta = heapq.heappop(_heap)
+            actual = _archivos.get(ruta)
+            if not actual or actual["version"] != version:
+                continue  # Entrada obsoleta (archivo actualizado o ya borrado)
+            if ruta in _fijados:
+                saltados.append((clase, prioridad, version, ruta))
+                continue
+            liberados = _quitar(ruta)
+            if POLITICA == "gdsf" and clase:
+                _inflacion = prioridad
+            ESTADISTICAS["bytes_evictados"] += liberados
+            ESTADISTICAS["archivos_evictados"] += 1
+            _persistir_pronto()
         try:
-            os.remove(file_to_remove)
-            print(f"[storage_manager] Archivo eliminado para liberar espacio: {file_to_remove}")
-        except:
+            _borrar(ruta, actual.get("blob"))
+        except OSError:
             pass
+
+    with _lock:
+        for entrada in saltados:
+            heapq.heappush(_heap, entrada)
+    if saltados:
+        print(f"[storage_manager] {len(saltados)} archivos en uso no se evictaron")
     return True
 
 def guardar_archivo(ruta_archivo: str, categoria: str = "otros"):
@@ -76,22 +445,73 @@ def guardar_archivo(ruta_archivo: str, categoria: str = "otros"):
         print(f"[storage_manager] Archivo guardado en: {destino}")
     except Exception as e:
         print(f"[storage_manager] Error moviendo archivo {ruta_archivo}: {e}")
+    registrar_archivo(destino, _deduplicar(destino))
 
-    # Limpiar espacio si excede el límite
-    limpiar_espacio()
+    # Limpiar espacio si excede el límite (si no lo hace ya mantenimiento en segundo plano)
+    if not LIMPIEZA_EN_SEGUNDO_PLANO:
+        limpiar_espacio()
     return destino
 
-def listar_archivos(categoria: str = None):
+def _metadatos(entrada, categoria: str) -> dict:
+    """Metadatos de una entrada de scandir: del índice si está, si no del stat de la entrada"""
+    ruta = os.path.abspath(entrada.path)
+    with _lock:
+        archivo = _archivos.get(ruta)
+        if archivo:
+            return {"ruta": ruta, "categoria": categoria, "tamaño": archivo["tamaño"],
+                    "mtime": archivo["mtime"], "accesos": archivo["accesos"],
+                    "ultimo_acceso": archivo["ultimo_acceso"], "compartido": _inodos.get(archivo["inodo"], 0) > 1}
+    st = entrada.stat()
+    return {"ruta": ruta, "categoria": categoria, "tamaño": st.st_size, "mtime": st.st_mtime,
+            "accesos": 0, "ultimo_acceso": st.st_mtime, "compartido": st.st_nlink > 2}
+
+def iterar_archivos(categoria: str = None, tamaño_min: int = 0, tamaño_max: int = None,
+                    antiguedad_min: float = None, antiguedad_max: float = None):
     """
-    Lista archivos en la carpeta de descargas o en una categoría específica.
+    Genera los archivos de una categoría (o de todas) con sus metadatos, sin armar listas.
+    Filtros opcionales por tamaño en bytes y antigüedad (segundos desde el mtime).
     """
-    archivos_list = []
+    with _lock:
+        _cargar()
     if categoria:
-        carpeta = CARPETAS.get(categoria.lower(), DOWNLOAD_PATH)
-        for f in os.listdir(carpeta):
-            archivos_list.append(os.path.join(carpeta, f))
+        carpetas = {categoria.lower(): CARPETAS.get(categoria.lower(), DOWNLOAD_PATH)}
     else:
-        for c in CARPETAS.values():
-            for f in os.listdir(c):
-                archivos_list.append(os.path.join(c, f))
-    return archivos_list
\ No newline at end of file
+        carpetas = CARPETAS
+    ahora = time.time()
+    for nombre_categoria, carpeta in carpetas.items():
+        try:
+            iterador = os.scandir(carpeta)
+        except OSError:
+            continue
+        with iterador:
+            for entrada in iterador:
+                if not entrada.is_file(follow_symlinks=False) or _ignorado(entrada.name):
+                    continue
+                datos = _metadatos(entrada, nombre_categoria)
+                antiguedad = ahora - datos["mtime"]
+                if datos["tamaño"] < tamaño_min or (tamaño_max is not None and datos["tamaño"] > tamaño_max):
+                    continue
+                if antiguedad_min is not None and antiguedad < antiguedad_min:
+                    continue
+                if antiguedad_max is not None and antiguedad > antiguedad_max:
+                    continue
+                yield datos
+
+def listar_pagina(categoria: str = None, cursor: str = None, limite: int = 20, **filtros):
+    """
+    Página de `limite` archivos en orden de ruta, empezando después de `cursor`.
+    Memoria O(limite) sin importar cuántos archivos haya: heapq.nsmallest sobre el generador.
+    Devuelve (archivos, siguiente_cursor); siguiente_cursor es None en la última página.
+    """
+    candidatos = (a for a in iterar_archivos(categoria, **filtros) if cursor is None or a["ruta"] > cursor)
+    pagina = heapq.nsmallest(limite + 1, candidatos, key=lambda a: a["ruta"])
+    if len(pagina) > limite:
+        return pagina[:limite], pagina[limite - 1]["ruta"]
+    return pagina, None
+
+def listar_archivos(categoria: str = None):
+    """
+    Lista archivos en la carpeta de descargas o en una categoría específica.
+    Para listados grandes usar iterar_archivos / listar_pagina.
+    """
+    return [a["ruta"] for a in iterar_archivos(categoria)]